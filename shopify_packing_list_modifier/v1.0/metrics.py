@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import contextlib
+from bisect import bisect_left
+from collections import defaultdict, deque
+
+# 延迟直方图的桶边界（单位：秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# 每个直方图保留的最近样本数，用于计算p50/p95
+RESERVOIR_SIZE = 1024
+
+# 导出路径：设置 SPLM_METRICS_PATH 后在运行结束（或按周期）导出指标。
+# 以 .json 结尾时导出JSON快照，否则导出Prometheus textfile格式（供node-exporter textfile collector采集）
+METRICS_PATH = os.environ.get('SPLM_METRICS_PATH')
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def _quantile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """
+    进程内指标集合：计数器 + 带桶直方图（附最近样本用于分位数）。
+
+    可导出为Prometheus textfile或JSON快照；工作进程可用 drain() 取出增量，在主进程用 merge() 合并。
+    """
+
+    def __init__(self, namespace='splm'):
+        self.namespace = namespace
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def reset(self):
+        """
+        清空全部指标并重建锁，供fork出的工作进程初始化时调用。
+
+        子进程继承的指标已由父进程记录，继承的锁也可能正被父进程的导出线程持有。
+        """
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _histogram(self, name, key):
+        hist = self.histograms.get((name, key))
+        if hist is None:
+            hist = {
+                'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+                'count': 0,
+                'sum': 0.0,
+                'samples': deque(maxlen=RESERVOIR_SIZE),
+            }
+            self.histograms[(name, key)] = hist
+        return hist
+
+    def inc(self, name, value=1, **labels):
+        """计数器累加"""
+        with self._lock:
+            self.counters[(name, _label_key(labels))] += value
+
+    def observe(self, name, value, **labels):
+        """记录一次直方图观测值"""
+        with self._lock:
+            hist = self._histogram(name, _label_key(labels))
+            hist['buckets'][bisect_left(LATENCY_BUCKETS, value)] += 1
+            hist['count'] += 1
+            hist['sum'] += value
+            hist['samples'].append(value)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """统计阶段耗时；阶段抛出异常时同时累加失败计数"""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.inc('stage_failures_total', stage=stage)
+            raise
+        finally:
+            self.observe('stage_latency_seconds', time.perf_counter() - start, stage=stage)
+
+    def drain(self):
+        """取出当前全部指标（可pickle），并清空本地数据"""
+        with self._lock:
+            state = {
+                'counters': list(self.counters.items()),
+                'histograms': [
+                    (name, key, hist['buckets'], hist['count'], hist['sum'], list(hist['samples']))
+                    for (name, key), hist in self.histograms.items()
+                ],
+            }
+            self._reset()
+        return state
+
+    def merge(self, state):
+        """合并其他进程 drain() 得到的指标"""
+        with self._lock:
+            for key, value in state['counters']:
+                self.counters[key] += value
+            for name, key, buckets, count, total, samples in state['histograms']:
+                hist = self._histogram(name, key)
+                hist['buckets'] = [a + b for a, b in zip(hist['buckets'], buckets)]
+                hist['count'] += count
+                hist['sum'] += total
+                hist['samples'].extend(samples)
+
+    def snapshot(self):
+        """生成JSON快照：计数器、直方图分位数及吞吐率"""
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            counters = {}
+            for (name, key), value in self.counters.items():
+                counters[f"{name}{_format_labels(key)}"] = value
+            histograms = {}
+            for (name, key), hist in self.histograms.items():
+                histograms[f"{name}{_format_labels(key)}"] = {
+                    'count': hist['count'],
+                    'sum': round(hist['sum'], 6),
+                    'p50': round(_quantile(hist['samples'], 0.5), 6),
+                    'p95': round(_quantile(hist['samples'], 0.95), 6),
+                }
+            documents = sum(v for (n, _), v in self.counters.items() if n == 'documents_total')
+            pages = sum(v for (n, _), v in self.counters.items() if n == 'pages_total')
+        return {
+            'timestamp': time.time(),
+            'uptime_seconds': round(elapsed, 3),
+            'documents_per_second': round(documents / elapsed, 4),
+            'pages_per_second': round(pages / elapsed, 4),
+            'counters': counters,
+            'histograms': histograms,
+        }
+
+    def to_prometheus(self):
+        """生成Prometheus文本格式"""
+        ns = self.namespace
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {ns}_uptime_seconds gauge",
+            f"{ns}_uptime_seconds {snapshot['uptime_seconds']}",
+            f"# TYPE {ns}_documents_per_second gauge",
+            f"{ns}_documents_per_second {snapshot['documents_per_second']}",
+            f"# TYPE {ns}_pages_per_second gauge",
+            f"{ns}_pages_per_second {snapshot['pages_per_second']}",
+        ]
+        quantile_lines = []
+        with self._lock:
+            typed = set()
+            for (name, key), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {ns}_{name} counter")
+                    typed.add(name)
+                lines.append(f"{ns}_{name}{_format_labels(key)} {value:g}")
+            for (name, key), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+                if name not in typed:
+                    lines.append(f"# TYPE {ns}_{name} histogram")
+                    typed.add(name)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), hist['buckets']):
+                    cumulative += count
+                    lines.append(f"{ns}_{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{ns}_{name}_sum{_format_labels(key)} {hist['sum']:.6f}")
+                lines.append(f"{ns}_{name}_count{_format_labels(key)} {hist['count']}")
+                # 最近样本的分位数单独作为gauge导出
+                for q in (0.5, 0.95):
+                    quantile_lines.append(
+                        f"{ns}_{name}_recent{_format_labels(key, [('quantile', q)])} "
+                        f"{_quantile(hist['samples'], q):.6f}"
+                    )
+        if quantile_lines:
+            families = sorted({line.split('{')[0] for line in quantile_lines})
+            for family in families:
+                lines.append(f"# TYPE {family} gauge")
+                lines.extend(line for line in quantile_lines if line.split('{')[0] == family)
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path=METRICS_PATH):
+        """原子写出指标文件（.json为JSON快照，其他为Prometheus textfile）"""
+        if not path:
+            return None
+        if path.endswith('.json'):
+            content = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        else:
+            content = self.to_prometheus()
+        output_dir = os.path.dirname(path) or '.'
+        os.makedirs(output_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=output_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def start_periodic_export(self, path=METRICS_PATH, interval=15):
+        """后台线程按周期导出指标，返回用于停止的Event"""
+        stop = threading.Event()
+        if not path:
+            return stop
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.export(path)
+                except OSError as e:
+                    print(f"指标导出失败：{e.__class__.__name__}: {str(e)}")
+
+        threading.Thread(target=loop, name='metrics-export', daemon=True).start()
+        return stop
+
+
+# 进程级指标实例
+METRICS = Metrics()
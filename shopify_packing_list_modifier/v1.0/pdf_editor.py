@@ -1,9 +1,13 @@
 import os
 import pdfplumber
 import fitz
+import numpy as np
 from typing import List, Dict
 import re
 
+# 行聚类阈值：按top排序后相邻单词的垂直间距超过该值即视为新行（单位：pt）
+LINE_GAP = 5
+
 class PDFEditor:
     def __init__(self, file_path: str):
         self.file_path = file_path
@@ -15,45 +19,113 @@ class PDFEditor:
         with pdfplumber.open(self.file_path) as pdf:
             for page_num, page in enumerate(pdf.pages):
                 words = page.extract_words(keep_blank_chars=True)
-                current_block = []
-                for word in words:
-                    if current_block and (word['top'] - current_block[-1]['top'] > 5):
-                        self._add_block(page_num, current_block)
-                        current_block = []
-                    current_block.append(word)
-                if current_block:
-                    self._add_block(page_num, current_block)
+                if not words:
+                    continue
+                # 整页单词框按列载入数组（逐列构建比逐行元组快）
+                x0, tops, x1, bottoms = np.array([
+                    [w['x0'] for w in words], [w['top'] for w in words],
+                    [w['x1'] for w in words], [w['bottom'] for w in words],
+                ], dtype=float)
+                # 按top稳定排序后向量化检测行间断点，为每个单词分配行号，不受单词输出顺序影响
+                by_top = np.argsort(tops, kind='stable')
+                line_id = np.empty(len(words), dtype=np.intp)
+                line_id[by_top] = np.concatenate(([0], np.cumsum(np.diff(tops[by_top]) > LINE_GAP)))
+                # 一次排序得到"行号优先、行内x0从左到右"的顺序，再用reduceat一次算出全部行的边界框
+                order = np.lexsort((x0, line_id))
+                starts = np.flatnonzero(np.diff(line_id[order], prepend=-1))
+                bboxes = zip(
+                    np.minimum.reduceat(x0[order], starts).tolist(),
+                    np.minimum.reduceat(tops[order], starts).tolist(),
+                    np.maximum.reduceat(x1[order], starts).tolist(),
+                    np.maximum.reduceat(bottoms[order], starts).tolist(),
+                )
+                ordered_words = [words[i] for i in order.tolist()]
+                bounds = starts.tolist() + [len(words)]
+                for start, end, bbox in zip(bounds, bounds[1:], bboxes):
+                    self._add_block(page_num, ordered_words[start:end], bbox)
         return self.text_blocks
 
-    def _add_block(self, page_num: int, words: list):
+    def _add_block(self, page_num: int, words: list, bbox: tuple = None):
         """构建文本块数据结构"""
-        x0 = min(word['x0'] for word in words)
-        top = min(word['top'] for word in words)
-        x1 = max(word['x1'] for word in words)
-        bottom = max(word['bottom'] for word in words)
+        if bbox is None:
+            bbox = (
+                min(word['x0'] for word in words),
+                min(word['top'] for word in words),
+                max(word['x1'] for word in words),
+                max(word['bottom'] for word in words),
+            )
         
         self.text_blocks.append({
             'page': page_num,
             'text': ' '.join(word['text'] for word in words),
-            'coordinates': (x0, top, x1, bottom),
+            'coordinates': bbox,
             'words': words
         })
 
-    def modify_pdf(self, modifications: List[Dict], output_path: str):
-        """执行PDF修改操作"""
+    def _stamp_whiteout_overlays(self, modifications: List[Dict]):
+        """
+        覆盖层模式：把每页的白色覆盖矩形构建为Form XObject后整体盖印。
+
+        覆盖矩形相同（页面尺寸 + 各矩形四边取一位小数）的页面归为一组，同组页面共用同一个覆盖页，
+        PyMuPDF在同一文档中重复显示同一来源页时复用同一个XObject，每页只增加一次引用。
+        水平范围也参与分组，不同长度的文本各自成组，覆盖层不会盖住其他页相邻保留的内容。
+        """
+        page_rects = {}
+        for mod in modifications:
+            page_rects.setdefault(mod['page'], []).append(mod['coordinates'])
+
+        groups = {}
+        for page_num, rects in page_rects.items():
+            page = self.doc.load_page(page_num)
+            key = tuple(sorted({tuple(round(v, 1) for v in r[:4]) for r in rects}))
+            groups.setdefault((tuple(page.rect), key), []).append((page, rects))
+
+        # 先建好全部覆盖页再盖印：overlay_doc在首次show_pdf_page后新增的页面无法再被引用
+        overlay_doc = fitz.open()
+        overlay_pages = []
+        for (_, key), members in groups.items():
+            # 组内矩形只有舍入误差，取并集保证每页都被完整覆盖
+            bounds = {r: list(r) for r in key}
+            for _, rects in members:
+                for r in rects:
+                    box = bounds[tuple(round(v, 1) for v in r[:4])]
+                    box[0], box[1] = min(box[0], r[0]), min(box[1], r[1])
+                    box[2], box[3] = max(box[2], r[2]), max(box[3], r[3])
+
+            width, height = members[0][0].rect.width, members[0][0].rect.height
+            overlay_page = overlay_doc.new_page(width=width, height=height)
+            shape = overlay_page.new_shape()
+            for box in bounds.values():
+                shape.draw_rect(box)
+            shape.finish(color=(1,1,1), fill=(1,1,1))
+            shape.commit()
+            overlay_pages.append((overlay_page.number, members))
+
+        for overlay_num, members in overlay_pages:
+            for page, _ in members:
+                page.show_pdf_page(page.rect, overlay_doc, overlay_num)
+        print(f"覆盖层模式：{len(page_rects)} 页共用 {len(groups)} 个覆盖层")
+        overlay_doc.close()
+
+    def modify_pdf(self, modifications: List[Dict], output_path: str, overlay: bool = False):
+        """执行PDF修改操作（overlay为True时白色覆盖层以共享XObject盖印）"""
+        if overlay:
+            self._stamp_whiteout_overlays(modifications)
+
         for mod in modifications:
             page = self.doc.load_page(mod['page'])
             
             # 添加白色覆盖层
             rect = mod['coordinates']
-            page.draw_rect(rect, color=(1,1,1), fill=(1,1,1))
+            if not overlay:
+                page.draw_rect(rect, color=(1,1,1), fill=(1,1,1))
             
             # 如果是替换操作则添加新文本
             if mod['type'] == 'replace':
                 page.insert_text(
                     point=(rect[0], rect[1] - mod.get('offset', 0)),
                     text=mod['new_text'],
-                    fontsize=12,
+                    fontsize=mod.get('fontsize', 12),
                     color=(0,0,0)
                 )
         
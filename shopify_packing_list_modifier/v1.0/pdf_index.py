@@ -0,0 +1,125 @@
+import os
+import json
+import heapq
+import hashlib
+import tempfile
+import contextlib
+from datetime import datetime
+
+# 持久索引目录：每个被扫描的目录对应一个索引文件，不在下载目录（可能是只读网络挂载）中写文件
+INDEX_DIR = os.environ.get(
+    'SPLM_PDF_INDEX_DIR', os.path.join(os.path.expanduser('~'), '.splm_pdf_index')
+)
+
+
+def _index_path(directory):
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, f"{digest}.json")
+
+def _load_index(directory):
+    try:
+        with open(_index_path(directory), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _save_index(directory, index):
+    try:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=INDEX_DIR)
+    except OSError as e:
+        print(f"警告：PDF索引保存失败：{e.__class__.__name__}: {str(e)}")
+        return
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, _index_path(directory))
+    except OSError as e:
+        print(f"警告：PDF索引保存失败：{e.__class__.__name__}: {str(e)}")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+
+def scan_pdfs(directory='.', use_index=True, name_filter=None):
+    """
+    扫描目录中的PDF文件，返回 (文件名, 修改时间, 大小) 列表。
+
+    基于os.scandir，复用DirEntry缓存的stat数据（Windows上随目录项返回，无需额外系统调用）。启用持久索引时：
+    - 目录修改时间未变：直接使用索引，只需stat目录本身
+    - 目录有变化：索引中已有且inode未变的文件沿用旧数据（POSIX上inode随目录项返回，无需stat），
+      只stat新文件和inode变化的文件（被重新下载或替换），已删除的文件从索引移除
+    原地改写文件内容不会改变目录修改时间和inode，此时仍沿用索引中的数据。
+
+    参数:
+    directory (str): 目录路径。
+    use_index (bool): 是否使用持久索引。
+    name_filter (callable): 文件名过滤函数，stat之前先按文件名过滤，避免对无关文件stat。
+
+    返回值:
+    list: (文件名, 修改时间, 大小) 元组列表。
+    """
+    index = _load_index(directory) if use_index else None
+    dir_mtime = os.stat(directory).st_mtime_ns
+
+    if index is not None and index.get('dir_mtime') == dir_mtime:
+        entries = index['files']
+    else:
+        known = index['files'] if index is not None else {}
+        entries = {}
+        complete = True
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.name.lower().endswith('.pdf'):
+                    continue
+                if name_filter is not None and not name_filter(entry.name):
+                    # 跳过的文件沿用旧数据（新文件不记录），索引不标记为最新，下次仍会重新扫描
+                    if entry.name in known:
+                        entries[entry.name] = known[entry.name]
+                    complete = False
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    # Windows上stat随目录项返回而inode需要额外系统调用，直接使用stat
+                    old = known.get(entry.name)
+                    if os.name != 'nt' and old is not None and len(old) == 3 and old[2] == entry.inode():
+                        entries[entry.name] = old
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries[entry.name] = [stat.st_mtime, stat.st_size, stat.st_ino]
+        if use_index:
+            _save_index(directory, {'dir_mtime': dir_mtime if complete else None, 'files': entries})
+
+    return [
+        (name, info[0], info[1]) for name, info in entries.items()
+        if name_filter is None or name_filter(name)
+    ]
+
+def latest_pdfs(directory='.', k=None, since=None, order=None, use_index=True):
+    """
+    按修改时间从新到旧返回PDF文件。
+
+    参数:
+    directory (str): 目录路径。
+    k (int): 只返回最新的k个（基于堆的top-k，不做完整排序）；为None时返回全部。
+    since (str): 只保留该日期（YYYY-MM-DD）及之后修改的文件。
+    order (str): 只保留文件名中包含该订单号的文件。
+    use_index (bool): 是否使用持久索引。
+
+    返回值:
+    list: (文件名, 修改时间, 大小) 元组列表，按修改时间从新到旧排列。
+    """
+    name_filter = None
+    if order:
+        order = str(order).lstrip('#')
+        name_filter = lambda name: order in name
+
+    entries = scan_pdfs(directory, use_index=use_index, name_filter=name_filter)
+    if since:
+        since_ts = datetime.strptime(since, '%Y-%m-%d').timestamp()
+        entries = [entry for entry in entries if entry[1] >= since_ts]
+
+    if k is None:
+        return sorted(entries, key=lambda entry: entry[1], reverse=True)
+    return heapq.nlargest(k, entries, key=lambda entry: entry[1])
@@ -1,36 +1,84 @@
 import pdf_editor
 import os
+import zlib
+import argparse
 import re
+import shutil
+import tempfile
+import contextlib
+import functools
 from datetime import datetime
 from reportlab.lib.pagesizes import A4
-from pypdf import PdfReader, PdfWriter, Transformation
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject, RectangleObject
+from metrics import METRICS
+from pdf_index import latest_pdfs
 
-def find_latest_pdf():
-    pdf_files = [f for f in os.listdir() if f.lower().endswith('.pdf')]
-    if not pdf_files:
+class JobFailed(Exception):
+    """处理阶段返回失败结果时抛出，使job_workspace保留工作目录"""
+
+@contextlib.contextmanager
+def job_workspace(base_dir=None, keep=False):
+    """为单次任务创建独立的临时工作目录，成功后自动清理，失败（异常或JobFailed）时保留以便排查"""
+    work_dir = tempfile.mkdtemp(prefix='splm_job_', dir=base_dir)
+    try:
+        yield work_dir
+    except BaseException:
+        print(f"任务失败，已保留工作目录: {work_dir}")
+        raise
+    else:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def publish_atomic(write_func, final_path):
+    """先写入同目录临时文件，再通过os.replace原子发布最终文件"""
+    output_dir = os.path.dirname(final_path) or '.'
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(final_path)}.", suffix='.part', dir=output_dir
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_func(f)
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return final_path
+
+def find_latest_pdf(pdf_list=None):
+    """返回最新的PDF文件名；pdf_list为latest_pdfs的结果时直接复用，不再重新扫描"""
+    if pdf_list is None:
+        pdf_list = latest_pdfs(k=1)
+    if not pdf_list:
         return None
-    latest = max(pdf_files, key=lambda f: os.path.getctime(f))
-    return latest
+    return pdf_list[0][0]
 
-def select_pdf_interactive():
-    latest = find_latest_pdf()
+def select_pdf_interactive(limit=20):
+    # 只扫描一次目录（scandir + 持久索引），最新文件和列表共用同一份结果；limit为0时列出全部文件
+    pdf_list = latest_pdfs(k=limit or None)
+    latest = find_latest_pdf(pdf_list)
     if latest:
         confirm = input(f"检测到最新PDF文件: {latest} 是否使用？(Y/n): ")
         if confirm.strip().lower() in ('', 'y'):
             return latest
     
-    pdf_list = [f for f in os.listdir() if f.lower().endswith('.pdf')]
     if not pdf_list:
         return None
     
-    print("\n当前目录PDF文件：")
-    for i, f in enumerate(pdf_list):
+    if limit:
+        print(f"\n当前目录最新的 {len(pdf_list)} 个PDF文件（--limit 0 列出全部）：")
+    else:
+        print(f"\n当前目录的 {len(pdf_list)} 个PDF文件：")
+    for i, (f, _, _) in enumerate(pdf_list):
         print(f"[{i}] {f}")
     
     while True:
         try:
             choice = int(input("请选择文件编号: "))
-            return pdf_list[choice]
+            return pdf_list[choice][0]
         except (ValueError, IndexError):
             print("无效的编号，请重新输入")
 
@@ -61,6 +109,19 @@ def extract_unique_name(text):
             unique_parts.append(part.lower().capitalize())
     return ' '.join(unique_parts)
 
+@functools.lru_cache(maxsize=4096)
+def text_width(font_name, font_size, text):
+    """测量文本宽度，按 (字体, 字号, 文本) 缓存"""
+    return stringWidth(text, font_name, font_size)
+
+def fit_font_size(text, x0, font_size=12, min_size=8, margin=20, font_name='Helvetica'):
+    """计算替换文本在页面右边距内能容纳的字号（PyMuPDF默认字体helv与Helvetica度量一致）"""
+    max_width = A4[0] - margin - x0
+    width = text_width(font_name, font_size, text)
+    if width <= max_width:
+        return font_size
+    return max(min_size, round(font_size * max_width / width, 1))
+
 def extract_order_number(blocks):
     """从文本块中提取订单号"""
     for block in blocks:
@@ -70,7 +131,14 @@ def extract_order_number(blocks):
     return datetime.now().strftime('%Y%m%d%H%M')
 
 
-def process_pdf_modifications(editor, output_file, blocks):
+def address_range(blocks):
+    """地址段删除范围：客户姓名之后到ITEMS QUANTITY之前"""
+    start_index = 4
+    end_index = next((i for i, b in enumerate(blocks) if 'ITEMS QUANTITY' in b['text']), 7) - 1
+    return start_index, end_index
+
+def build_modifications(blocks, start_index, end_index, last_third_index=None):
+    """按一份发货单的文本块生成修改列表：替换SHIP TO和客户姓名，删除地址段和倒数第三块"""
     modifications = []
     
     # 替换索引2为SHIP TO
@@ -91,17 +159,10 @@ def process_pdf_modifications(editor, output_file, blocks):
             'page': blocks[3]['page'],
             'coordinates': blocks[3]['coordinates'],
             'new_text': unique_name,
+            'fontsize': fit_font_size(unique_name, blocks[3]['coordinates'][0]),  # 长姓名自动缩小字号
             'offset': -10  # 新增更大偏移量
         })
     
-    # 动态确定地址删除范围
-    start_index = 4
-    end_index = next((i for i, b in enumerate(blocks) if 'ITEMS QUANTITY' in b['text']), 7) - 1
-    
-    # 记录删除范围到preview
-    with open(output_file, 'a', encoding='utf-8') as f:
-        f.write(f'\n=== 删除地址块范围 ===\n{start_index}-{end_index}\n')
-    
     # 删除地址区块
     for idx in range(start_index, end_index+1):
         if idx < len(blocks):
@@ -111,51 +172,84 @@ def process_pdf_modifications(editor, output_file, blocks):
                 'coordinates': blocks[idx]['coordinates']
             })
     
-    # 删除倒数第三块（从preview.txt读取）
+    # 删除倒数第三块
+    if last_third_index is not None and last_third_index < len(blocks):
+        modifications.append({
+            'type': 'delete',
+            'page': blocks[last_third_index]['page'],
+            'coordinates': blocks[last_third_index]['coordinates']
+        })
+    return modifications
+
+def build_page_modifications(blocks):
+    """
+    覆盖层模式：批量导出的多页文件中每页是一份发货单，对每个含锚点（SHIP TO / ITEMS QUANTITY）的页面
+    按该页自身的文本块生成修改；覆盖行高度相同的页面由覆盖层共用同一个XObject。
+    """
+    pages = {}
+    for block in blocks:
+        pages.setdefault(block['page'], []).append(block)
+
+    modifications = []
+    skipped = 0
+    for page_blocks in pages.values():
+        if (len(page_blocks) < 3 or 'SHIP TO' not in page_blocks[2]['text']
+                or not any('ITEMS QUANTITY' in b['text'] for b in page_blocks)):
+            skipped += 1
+            continue
+        start_index, end_index = address_range(page_blocks)
+        modifications.extend(build_modifications(page_blocks, start_index, end_index, len(page_blocks) - 3))
+    if skipped:
+        print(f"覆盖层模式：{skipped} 页缺少SHIP TO/ITEMS QUANTITY锚点，未做修改")
+    return modifications
+
+def process_pdf_modifications(editor, output_file, blocks, work_dir='output', overlay=False):
+    # 动态确定地址删除范围
+    start_index, end_index = address_range(blocks)
+    
+    # 记录删除范围到preview
+    with open(output_file, 'a', encoding='utf-8') as f:
+        f.write(f'\n=== 删除地址块范围 ===\n{start_index}-{end_index}\n')
+    
+    # 倒数第三块索引（从preview.txt读取）
+    last_third_index = None
     try:
         with open(output_file, 'r', encoding='utf-8') as f:
             content = f.read()
             if '倒数第三块索引 ===' in content:
                 index_section = content.split('倒数第三块索引 ===\n')
                 last_third_index = int(index_section[-1].split('\n')[0].strip())
-                if last_third_index < len(blocks):
-                    modifications.append({
-                        'type': 'delete',
-                        'page': blocks[last_third_index]['page'],
-                        'coordinates': blocks[last_third_index]['coordinates']
-                    })
     except Exception as e:
         print(f'读取预览文件失败: {e}')
         return
-        if last_third_index < len(blocks):
-            modifications.append({
-                'type': 'delete',
-                'page': blocks[last_third_index]['page'],
-                'coordinates': blocks[last_third_index]['coordinates']
-            })
     
-    # 创建输出目录并保存
-    output_dir = 'output'
-    os.makedirs(output_dir, exist_ok=True)
+    if overlay:
+        # 逐页生成修改，使批量文件中版式相同的页面共用覆盖层
+        modifications = build_page_modifications(blocks)
+    else:
+        modifications = build_modifications(blocks, start_index, end_index, last_third_index)
+    
+    # 中间A4文件保存到任务工作目录
+    os.makedirs(work_dir, exist_ok=True)
     order_num = extract_order_number(blocks)
-    output_pdf = os.path.join(output_dir, f'{order_num}.pdf')
+    output_pdf = os.path.join(work_dir, f'{order_num}.pdf')
     
-    editor.modify_pdf(modifications, output_pdf)
+    editor.modify_pdf(modifications, output_pdf, overlay=overlay)
     print(f'\n修改后的PDF已保存至: {output_pdf}')
 
     return output_pdf
 
-def split_a4_to_a5_vertical(input_pdf_path):
+def split_a4_to_a5_vertical(input_pdf_path, output_dir='output'):
     """
     将A4尺寸的PDF文件垂直分割为两个A5尺寸的PDF文件，并保存到指定目录。
 
     参数:
     input_pdf_path (str): 输入的A4尺寸PDF文件路径。
+    output_dir (str): 最终输出目录，文件通过原子重命名发布。
 
     返回值:
     bool: 如果分割成功返回True，否则返回False。
     """
-    output_dir = 'output'
     try:
         os.makedirs(output_dir, exist_ok=True)
     except PermissionError:
@@ -168,8 +262,6 @@ def split_a4_to_a5_vertical(input_pdf_path):
     output_pdf_path = os.path.join(output_dir, pdf_name)
 
     try:
-        os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
-        
         reader = PdfReader(input_pdf_path)
         writer = PdfWriter()
 
@@ -177,44 +269,40 @@ def split_a4_to_a5_vertical(input_pdf_path):
         A4_WIDTH, A4_HEIGHT = A4
         A5_HEIGHT = A4_HEIGHT / 2  # 420.945pt
 
+        saved_bytes = 0
         for page in reader.pages:
             # ==================================================================
-            # 处理上半部分 (关键修正点)
+            # 处理上半部分：页面只导入一次，通过MediaBox取原页面上半部分
             # ==================================================================
-            # 1. 创建新A5页面
-            top_page = writer.add_blank_page(width=A4_WIDTH, height=A5_HEIGHT)
-            
-            # 2. 克隆原始页面
-            top_clone = page.clone(pdf_dest=writer)
-            
-            # 3. 设置裁剪区域
-            top_clone.cropbox.upper_left = (0, A4_HEIGHT)        # 原页面上半部分
-            top_clone.cropbox.lower_right = (A4_WIDTH, A5_HEIGHT)
-            
-            # 4. 变换方向修正（关键！）
-            transform = Transformation().translate(
-                tx=0, 
-                ty=-(A4_HEIGHT - A5_HEIGHT)  # 正确计算平移量
-            )
-            
-            # 5. 应用变换并合并
-            top_page.merge_page(top_clone)
-            top_page.add_transformation(transform)  # 先合并后变换
+            top_page = writer.add_page(page)
+            contents = top_page.get_contents()
+            raw_data = contents.get_data() if contents is not None else b''
+            top_page.compress_content_streams()  # 压缩内容流
+            top_page.mediabox = RectangleObject((0, A5_HEIGHT, A4_WIDTH, A4_HEIGHT))
+            top_page.cropbox = RectangleObject((0, A5_HEIGHT, A4_WIDTH, A4_HEIGHT))
 
             # ==================================================================
-            # 处理下半部分 (已验证正确)
+            # 处理下半部分：与上半部分共享同一份内容流和资源，不再重复克隆
             # ==================================================================
             bottom_page = writer.add_blank_page(width=A4_WIDTH, height=A5_HEIGHT)
-            bottom_clone = page.clone(pdf_dest=writer)
-            bottom_clone.cropbox.upper_left = (0, A5_HEIGHT)
-            bottom_clone.cropbox.lower_right = (A4_WIDTH, 0)
-            bottom_page.merge_page(bottom_clone)
-
-        # 保存输出文件
-        with open(output_pdf_path, "wb") as f:
-            writer.write(f)
+            for key in ('/Contents', '/Resources'):
+                if key in top_page:
+                    bottom_page[NameObject(key)] = top_page.raw_get(key)
+
+            # 估算节省的字节数：原实现每个A5页各合并一份未压缩的内容流，现在只写一份Flate压缩流
+            # （用zlib压缩长度近似pypdf写出的压缩流长度）
+            if raw_data:
+                saved_bytes += 2 * len(raw_data) - len(zlib.compress(raw_data))
+
+        # 跨页面合并相同的字体、资源等对象（旧版pypdf无此接口时跳过）
+        if hasattr(writer, 'compress_identical_objects'):
+            writer.compress_identical_objects()  # 默认即合并相同对象并删除孤立对象
+
+        # 保存输出文件（先写临时文件再原子替换）
+        publish_atomic(writer.write, output_pdf_path)
+        METRICS.inc('output_bytes_total', os.path.getsize(output_pdf_path))
             
-        print(f"生成成功：{output_pdf_path}")
+        print(f"生成成功：{output_pdf_path}（内容流共享与压缩估算节省约 {saved_bytes} 字节）")
         return True
 
     except Exception as e:
@@ -223,32 +311,61 @@ def split_a4_to_a5_vertical(input_pdf_path):
 
 
 if __name__ == "__main__":
-    input_pdf = select_pdf_interactive()
+    parser = argparse.ArgumentParser(description="Shopify发货单处理工具")
+    parser.add_argument("--overlay", action='store_true',
+                        help="覆盖层模式：相同版式页面的白色覆盖层构建一次并以共享XObject盖印")
+    parser.add_argument("--limit", type=int, default=20, help="交互选择时列出的最新文件数量（默认 20，0 表示全部）")
+    args = parser.parse_args()
+
+    input_pdf = select_pdf_interactive(args.limit)
     if not input_pdf:
         print("未找到可用的PDF文件")
         exit()
     
-    editor = pdf_editor.PDFEditor(input_pdf)
-    output_file = "preview.txt"
-    print(f"即将生成预览文件: {output_file}")
-    blocks = editor.extract_text_blocks()
-    save_success = save_pdf_preview(editor, output_file)
-    if not save_success:
-        exit()
-    
-    # 提取并保存姓名信息
-    if len(blocks) > 3:
-        name_text = blocks[3]['text']
-        unique_name = extract_unique_name(name_text)
-        with open(output_file, 'a', encoding='utf-8') as f:
-            f.write(f'\n\n=== 客户姓名 ===\n{unique_name}')
-        # 提取并保存倒数第三个区块信息
-        if len(blocks) >= 3:
-            third_last_index = len(blocks) - 3
-            with open(output_file, 'a', encoding='utf-8') as f:
-                f.write(f'\n\n=== 倒数第三块索引 ===\n{third_last_index}')
-    
-    # 在main流程末尾添加处理
-    A4_pdf = process_pdf_modifications(editor, output_file, blocks)
+    # 每次任务使用独立的工作目录，预览文件和中间PDF互不干扰；任一阶段失败时保留
+    blocks = []
+    split_ok = False
+    try:
+        with job_workspace() as work_dir:
+            editor = pdf_editor.PDFEditor(input_pdf)
+            output_file = os.path.join(work_dir, "preview.txt")
+            print(f"即将生成预览文件: {output_file}")
+            with METRICS.timer('extract'):
+                blocks = editor.extract_text_blocks()
+            save_success = save_pdf_preview(editor, output_file)
+            if not save_success:
+                raise JobFailed('预览')
+            
+            # 提取并保存姓名信息
+            if len(blocks) > 3:
+                name_text = blocks[3]['text']
+                unique_name = extract_unique_name(name_text)
+                with open(output_file, 'a', encoding='utf-8') as f:
+                    f.write(f'\n\n=== 客户姓名 ===\n{unique_name}')
+                # 提取并保存倒数第三个区块信息
+                if len(blocks) >= 3:
+                    third_last_index = len(blocks) - 3
+                    with open(output_file, 'a', encoding='utf-8') as f:
+                        f.write(f'\n\n=== 倒数第三块索引 ===\n{third_last_index}')
+            
+            # 在main流程末尾添加处理
+            with METRICS.timer('modify'):
+                A4_pdf = process_pdf_modifications(editor, output_file, blocks, work_dir, overlay=args.overlay)
+            if A4_pdf is None:
+                raise JobFailed('修改')
+
+            with METRICS.timer('split'):
+                split_ok = split_a4_to_a5_vertical(A4_pdf)
+            if not split_ok:
+                raise JobFailed('拆分')
+    except JobFailed as e:
+        print(f"{e}阶段失败")
+
+    METRICS.inc('documents_total', status='ok' if split_ok else 'failed')
+    if blocks:
+        METRICS.inc('pages_total', blocks[-1]['page'] + 1)
 
-    split_a4_to_a5_vertical(A4_pdf)
\ No newline at end of file
+    # 设置SPLM_METRICS_PATH时导出指标
+    METRICS.export()
+    if not split_ok:
+        exit(1)
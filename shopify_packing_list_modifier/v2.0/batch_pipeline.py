@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import glob
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import shopify_packing_list_modifier as splm
+from metrics import METRICS, METRICS_PATH
+from pick_list import PickListAggregator
+from print_job import MergedPrintJob
+
+
+def read_file(path):
+    """读取PDF文件的全部字节（在线程池中执行，不阻塞事件循环）"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+def run_stages(pdf_bytes):
+    """
+    在工作进程中执行CPU密集的转换阶段：提取 -> 分析 -> 生成新元数据 -> 调整位置 -> 排版适配 -> 渲染 -> A5拆分。
+
+    每个任务使用独立的工作目录（阶段失败时保留以便排查），最终A5文件只以字节形式返回，由主进程的异步写入队列发布。
+
+    参数:
+    pdf_bytes (bytes): 输入PDF文件内容。
+
+    返回值:
+    tuple: (订单号, A5 PDF字节, 输入页数, 商品行)。任一阶段失败时返回None。
+    """
+    # 工作进程会连续处理多个订单，先清除上一个订单的锚点ID、订单号和商品行
+    splm.reset_order_state()
+    try:
+        with splm.job_workspace() as work_dir:
+            with METRICS.timer('extract'):
+                metadata = splm.extract_text_with_metadata(io.BytesIO(pdf_bytes), work_dir)
+            if metadata is None:
+                raise splm.JobFailed('提取')
+            with METRICS.timer('analyze'):
+                delete_targets = splm.analyze_metadata(metadata)
+            if delete_targets is None:
+                raise splm.JobFailed('分析')
+            with METRICS.timer('layout'):
+                new_meta = splm.create_new_metadata(metadata, delete_targets, work_dir)
+                if new_meta is None:
+                    raise splm.JobFailed('生成元数据')
+                adj_meta = splm.adjust_metadata_positions(new_meta, work_dir)
+                adj_meta = splm.fit_metadata_to_page(adj_meta)
+            with METRICS.timer('render'):
+                a4_pdf_path = splm.generate_new_pdf(adj_meta, work_dir)
+            if a4_pdf_path is None:
+                raise splm.JobFailed('渲染')
+
+            with METRICS.timer('split'):
+                writer, _ = splm.build_a5_writer(a4_pdf_path)
+                buffer = io.BytesIO()
+                writer.write(buffer)
+    except splm.JobFailed as e:
+        print(f"错误：{e}阶段失败")
+        return None
+    pages = len({meta['页码'] for meta in metadata})
+    return splm.order_number, buffer.getvalue(), pages, splm.item_rows
+
+def init_worker():
+    """
+    工作进程初始化：清空从父进程继承的指标，再注册嵌入字体。
+
+    以fork方式启动的工作进程会复制父进程当时的METRICS（如已记录的读取耗时），
+    不清空的话第一次drain会把这些数据再交回主进程合并，造成重复计数。
+    """
+    METRICS.reset()
+    splm.register_embedded_fonts()
+
+def convert_document(pdf_bytes):
+    """
+    工作进程入口：执行转换并取出本进程记录的指标增量，交给主进程合并。
+
+    返回值:
+    tuple: (run_stages的结果或None, 指标增量)。
+    """
+    try:
+        result = run_stages(pdf_bytes)
+    except Exception as e:
+        print(f"转换异常：{e.__class__.__name__}: {str(e)}")
+        result = None
+    return result, METRICS.drain()
+
+async def run_batch(pdf_paths, output_dir='output', workers=None, prefetch=2, write_queue=4,
+                    metrics_path=None, metrics_interval=15, pick_list=None, print_job=None,
+                    preview=None):
+    """
+    异步批量转换：预读下一个PDF、在进程池中执行提取/渲染、通过有界队列异步写出结果。
+
+    三个阶段通过有界队列连接，形成背压：
+    - 读取：最多预读 prefetch 个文件，转换跟不上时暂停读取
+    - 转换：workers 个进程并行执行CPU密集阶段
+    - 写入：写入队列最多积压 write_queue 个结果，磁盘（如网络挂载目录）较慢时转换会等待
+
+    参数:
+    pdf_paths (list): 输入PDF文件路径列表。
+    output_dir (str): 输出目录。
+    workers (int): 转换进程数，默认为CPU核数。
+    prefetch (int): 预读队列长度。
+    write_queue (int): 写入队列长度。
+    metrics_path (str): 指标导出路径（.json为JSON快照，其他为Prometheus textfile），为None时不导出。
+    metrics_interval (float): 指标周期导出间隔（秒）。
+    pick_list (PickListAggregator): 拣货单汇总器，复用提取阶段解析出的商品行，只汇总写出成功的订单，为None时不汇总。
+    print_job (MergedPrintJob): 合并打印任务。设置后各订单追加到分卷批次PDF中，不再单独输出文件。
+    preview (PreviewStage): 预览阶段，写出成功的订单提交到后台线程渲染缩略图，为None时不生成预览。
+
+    返回值:
+    dict: 输入路径 -> 输出路径，失败的文件对应None。
+    """
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    read_q = asyncio.Queue(maxsize=prefetch)
+    write_q = asyncio.Queue(maxsize=write_queue)
+    results = {}
+    pending_picks = []  # 合并模式：(分卷路径, 订单号, 商品行)，等分卷写出后再汇总
+
+    async def reader():
+        for path in pdf_paths:
+            try:
+                with METRICS.timer('read'):
+                    data = await loop.run_in_executor(None, read_file, path)
+            except OSError as e:
+                print(f"读取失败：{path}：{e.__class__.__name__}: {str(e)}")
+                METRICS.inc('documents_total', status='failed')
+                results[path] = None
+                continue
+            await read_q.put((path, data))
+        for _ in range(workers):
+            await read_q.put(None)
+
+    async def converter(pool):
+        while (item := await read_q.get()) is not None:
+            path, data = item
+            try:
+                converted, worker_metrics = await loop.run_in_executor(pool, convert_document, data)
+                METRICS.merge(worker_metrics)
+            except Exception as e:
+                print(f"转换失败：{path}：{e.__class__.__name__}: {str(e)}")
+                converted = None
+            if converted is None:
+                METRICS.inc('documents_total', status='failed')
+                results[path] = None
+                continue
+            order_number, pdf_bytes, pages, item_rows = converted
+            METRICS.inc('pages_total', pages)
+            await write_q.put((path, order_number, pdf_bytes, item_rows))
+
+    async def writer():
+        while (item := await write_q.get()) is not None:
+            path, order_number, pdf_bytes, item_rows = item
+            if print_job is not None:
+                output_pdf_path = print_job.current_part
+            else:
+                output_pdf_path = os.path.join(output_dir, f"{order_number}.pdf")
+            try:
+                with METRICS.timer('write'):
+                    if print_job is not None:
+                        # 合并模式：追加到当前分卷（写入协程唯一，追加顺序即完成顺序）
+                        output_pdf_path = await loop.run_in_executor(None, print_job.add, order_number, pdf_bytes)
+                    else:
+                        await loop.run_in_executor(
+                            None, splm.publish_atomic, lambda f, data=pdf_bytes: f.write(data), output_pdf_path
+                        )
+            except Exception as e:
+                # 捕获所有异常：写入协程一旦退出，写入队列不再消费，转换协程会永久阻塞
+                print(f"写入失败：{output_pdf_path}：{e.__class__.__name__}: {str(e)}")
+                METRICS.inc('documents_total', status='failed')
+                results[path] = None
+                continue
+            METRICS.inc('documents_total', status='ok')
+            METRICS.inc('output_bytes_total', len(pdf_bytes))
+            if preview is not None:
+                preview.submit(order_number, pdf_bytes)
+            results[path] = output_pdf_path
+            if pick_list is not None:
+                if print_job is not None:
+                    # 合并模式下订单随分卷写出才落盘，分卷写出成功后再计入拣货单
+                    pending_picks.append((output_pdf_path, order_number, item_rows))
+                else:
+                    pick_list.add(order_number, item_rows)
+            if print_job is not None:
+                print(f"已加入合并分卷：{output_pdf_path}（#{order_number}）")
+            else:
+                print(f"生成成功：{output_pdf_path}")
+
+    stop_export = METRICS.start_periodic_export(metrics_path, metrics_interval)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            writer_task = asyncio.create_task(writer())
+            await asyncio.gather(reader(), *(converter(pool) for _ in range(workers)))
+            await write_q.put(None)
+            await writer_task
+            if print_job is not None:
+                try:
+                    await loop.run_in_executor(None, print_job.close)
+                except Exception as e:
+                    print(f"合并分卷写出失败：{e.__class__.__name__}: {str(e)}")
+                # 分卷写出失败时，其中的订单全部记为失败
+                for path, output in results.items():
+                    if output is not None and output in print_job.failed_parts:
+                        results[path] = None
+                for part_path, order_number, item_rows in pending_picks:
+                    if part_path not in print_job.failed_parts:
+                        pick_list.add(order_number, item_rows)
+    finally:
+        stop_export.set()
+        METRICS.export(metrics_path)
+
+    return results
+
+def collect_pdf_paths(inputs):
+    """展开命令行输入：目录取其中全部PDF，文件直接使用"""
+    pdf_paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            pdf_paths.extend(sorted(
+                p for p in glob.glob(os.path.join(item, '*')) if p.lower().endswith('.pdf')
+            ))
+        else:
+            pdf_paths.append(item)
+    return pdf_paths
+
+def main():
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description="异步批量转换Shopify发货单。")
+    parser.add_argument("inputs", nargs='+', help="PDF文件或包含PDF文件的目录")
+    parser.add_argument("--output-dir", default='output', help="输出目录（默认 output）")
+    parser.add_argument("--workers", type=int, default=None, help="转换进程数（默认CPU核数）")
+    parser.add_argument("--prefetch", type=int, default=2, help="预读文件数（默认 2）")
+    parser.add_argument("--write-queue", type=int, default=4, help="写入队列长度（默认 4）")
+    parser.add_argument("--metrics-path", default=METRICS_PATH,
+                        help="指标导出路径，.json为JSON快照，其他为Prometheus textfile（默认读取SPLM_METRICS_PATH）")
+    parser.add_argument("--metrics-interval", type=float, default=15, help="指标周期导出间隔秒数（默认 15）")
+    parser.add_argument("--merge", action='store_true', help="合并打印模式：所有订单追加到分卷批次PDF（带订单书签）")
+    parser.add_argument("--merge-every", type=int, default=20, help="合并模式下每N个订单写出一个分卷（默认 20）")
+    parser.add_argument("--contact-sheet", default=None, help="预览总览图输出路径（PNG，需要PyMuPDF）")
+    parser.add_argument("--thumb-dpi", type=int, default=36, help="预览缩略图分辨率（默认 36）")
+    parser.add_argument("--pick-list", default=None, help="批量拣货汇总输出路径（.csv 或 .json）")
+    parser.add_argument("--pick-list-detail", default=None, help="逐单追加的拣货明细CSV路径")
+    parser.add_argument("--pick-list-pdf", default=None, help="拣货汇总页PDF路径")
+    args = parser.parse_args()
+
+    pdf_paths = collect_pdf_paths(args.inputs)
+    if not pdf_paths:
+        print("错误：未找到PDF文件")
+        return
+
+    pick_list = None
+    if args.pick_list or args.pick_list_detail or args.pick_list_pdf:
+        pick_list = PickListAggregator(args.pick_list_detail)
+
+    print_job = MergedPrintJob(args.output_dir, flush_every=args.merge_every) if args.merge else None
+
+    preview = None
+    if args.contact_sheet:
+        # 预览依赖PyMuPDF，仅在需要时导入
+        from preview import PreviewStage
+        preview = PreviewStage(dpi=args.thumb_dpi)
+
+    try:
+        results = asyncio.run(run_batch(
+            pdf_paths,
+            output_dir=args.output_dir,
+            workers=args.workers,
+            prefetch=args.prefetch,
+            write_queue=args.write_queue,
+            metrics_path=args.metrics_path,
+            metrics_interval=args.metrics_interval,
+            pick_list=pick_list,
+            print_job=print_job,
+            preview=preview,
+        ))
+        if preview is not None:
+            preview.write_contact_sheet(args.contact_sheet)
+    finally:
+        if pick_list is not None:
+            pick_list.close()
+        if preview is not None:
+            preview.close()
+
+    if pick_list is not None:
+        if args.pick_list:
+            pick_list.write(args.pick_list)
+        if args.pick_list_pdf:
+            pick_list.write_summary_pdf(args.pick_list_pdf)
+    failed = [path for path, output in results.items() if output is None]
+    print(f"\n批量转换完成：成功 {len(results) - len(failed)} 个，失败 {len(failed)} 个")
+    for path in failed:
+        print(f"  失败：{path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import io
+import csv
+import json
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+
+from shopify_packing_list_modifier import publish_atomic
+
+
+class PickListAggregator:
+    """
+    批量拣货单汇总：逐单累加商品数量，内存中只保留按SKU（无SKU时按商品名）汇总的结果。
+
+    可选的明细文件在每个订单处理完时立即追加写入（订单号, 商品, SKU, 数量），
+    汇总结果在批次结束时以CSV/JSON输出，并可生成汇总PDF。
+    """
+
+    def __init__(self, detail_path=None):
+        self.totals = {}
+        self.order_count = 0
+        self._detail_file = None
+        self._detail_writer = None
+        if detail_path:
+            self._detail_file = open(detail_path, 'w', encoding='utf-8', newline='')
+            self._detail_writer = csv.writer(self._detail_file)
+            self._detail_writer.writerow(['order', 'item', 'sku', 'quantity'])
+
+    def add(self, order_number, rows):
+        """累加一个订单的商品行，同一订单中重复出现的商品只计一次订单数"""
+        self.order_count += 1
+        seen = set()
+        for row in rows:
+            # SKU与商品名分属不同命名空间，避免商品名恰好等于其他商品的SKU时被合并
+            key = ('sku', row['sku']) if row['sku'] else ('item', row['item'])
+            entry = self.totals.setdefault(key, {
+                'item': row['item'],
+                'sku': row['sku'],
+                'quantity': 0,
+                'orders': 0,
+            })
+            entry['quantity'] += row['quantity']
+            if key not in seen:
+                seen.add(key)
+                entry['orders'] += 1
+            if self._detail_writer is not None:
+                self._detail_writer.writerow([order_number, row['item'], row['sku'], row['quantity']])
+        if self._detail_file is not None:
+            self._detail_file.flush()
+
+    def rows(self):
+        """按商品名排序的汇总行"""
+        return sorted(self.totals.values(), key=lambda entry: (entry['item'].lower(), entry['sku']))
+
+    def write(self, output_path):
+        """写出汇总拣货单：.json为JSON，其他为CSV"""
+        if output_path.endswith('.json'):
+            content = json.dumps({
+                'orders': self.order_count,
+                'items': self.rows(),
+            }, ensure_ascii=False, indent=2)
+        else:
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=['item', 'sku', 'quantity', 'orders'])
+            writer.writeheader()
+            writer.writerows(self.rows())
+            content = buffer.getvalue()
+        publish_atomic(lambda f: f.write(content.encode('utf-8')), output_path)
+        print(f"拣货单已生成：{output_path}（{self.order_count} 个订单，{len(self.totals)} 种商品）")
+        return output_path
+
+    def write_summary_pdf(self, output_path, font_size=10):
+        """生成拣货汇总PDF，超出一页时自动分页"""
+        page_width, page_height = A4
+        margin = 40
+        line_height = font_size * 1.6
+
+        buffer = io.BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+
+        def header(y):
+            c.setFont('Helvetica-Bold', font_size + 2)
+            c.drawString(margin, y, f"Pick List - {self.order_count} orders")
+            y -= line_height * 1.5
+            c.setFont('Helvetica', font_size)
+            c.drawString(margin, y, "ITEM")
+            c.drawString(page_width - margin - 180, y, "SKU")
+            c.drawRightString(page_width - margin, y, "QTY")
+            return y - line_height
+
+        y = header(page_height - margin)
+        for entry in self.rows():
+            if y < margin:
+                c.showPage()
+                y = header(page_height - margin)
+            c.drawString(margin, y, entry['item'][:60])
+            c.drawString(page_width - margin - 180, y, entry['sku'])
+            c.drawRightString(page_width - margin, y, str(entry['quantity']))
+            y -= line_height
+        c.save()
+
+        publish_atomic(lambda f: f.write(buffer.getvalue()), output_path)
+        print(f"拣货汇总页已生成：{output_path}")
+        return output_path
+
+    def close(self):
+        """关闭明细文件"""
+        if self._detail_file is not None:
+            self._detail_file.close()
+            self._detail_file = None
+            self._detail_writer = None
@@ -0,0 +1,235 @@
+import os
+import glob
+import hashlib
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz
+
+# 缩略图参数
+THUMB_DPI = 36                      # 低分辨率即可看出版面重叠等问题
+THUMB_CACHE_DIR = os.environ.get(
+    'SPLM_THUMB_CACHE', os.path.join(os.path.expanduser('~'), '.splm_thumbs')
+)
+THUMB_CACHE_MAX_BYTES = 64 * 1024 * 1024
+SHEET_COLUMNS = 6
+SHEET_GAP = 8                       # 缩略图间距（单位：pt）
+LABEL_PX = 12                       # 标签文字在总览图中的像素高度，与渲染分辨率无关
+
+
+class ThumbnailCache:
+    """
+    以内容哈希为键的缩略图磁盘缓存，超过容量上限时按最近使用时间淘汰。
+
+    同一份输出PDF重复预览（例如重跑批次）时直接复用已渲染的PNG。
+    """
+
+    def __init__(self, cache_dir=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total = None      # 缓存目录总大小，首次写入时扫描一次，之后累加
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def get(self, key):
+        """读取缓存，命中时刷新访问时间"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        self.hits += 1
+        return data
+
+    def put(self, key, png_bytes):
+        """原子写入缓存，累计大小超过上限时才扫描目录淘汰"""
+        fd, tmp_path = tempfile.mkstemp(suffix='.part', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(png_bytes)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_path)
+            return
+        if self._total is None:
+            self.evict()
+        else:
+            self._total += len(png_bytes)
+            if self._total > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """扫描缓存目录，总大小超过上限时删除最久未使用的缩略图，并更新累计大小"""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.png'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._total = total
+
+
+def render_thumbnails(pdf_bytes, dpi=THUMB_DPI, cache=None):
+    """
+    将PDF的每一页渲染为低分辨率PNG缩略图。
+
+    参数:
+    pdf_bytes (bytes): PDF文件内容。
+    dpi (int): 渲染分辨率。
+    cache (ThumbnailCache): 缩略图缓存，为None时不缓存。
+
+    返回值:
+    list: 每页的PNG字节。
+    """
+    digest = hashlib.sha1(pdf_bytes).hexdigest()
+    thumbs = []
+    # 打开文档开销很小，主要开销在渲染，命中缓存时跳过渲染
+    doc = fitz.open(stream=pdf_bytes, filetype='pdf')
+    try:
+        for page_idx in range(doc.page_count):
+            key = f"{digest}_{dpi}_{page_idx}"
+            png = cache.get(key) if cache is not None else None
+            if png is None:
+                png = doc.load_page(page_idx).get_pixmap(dpi=dpi).tobytes('png')
+                if cache is not None:
+                    cache.put(key, png)
+            thumbs.append(png)
+    finally:
+        doc.close()
+    return thumbs
+
+def compose_contact_sheet(thumbnails, output_path, columns=SHEET_COLUMNS, dpi=THUMB_DPI):
+    """
+    把缩略图按网格拼接成一张带订单标签的总览图（PNG）。
+
+    参数:
+    thumbnails (list): (标签, PNG字节) 列表。
+    output_path (str): 输出图片路径。
+    columns (int): 每行缩略图数量。
+    dpi (int): 缩略图的渲染分辨率，用于换算缩略图在总览图中的尺寸。
+
+    返回值:
+    str: 输出图片路径；没有缩略图时返回None。
+    """
+    if not thumbnails:
+        return None
+
+    # 以第一张缩略图的尺寸作为网格单元（输出均为A5页面）
+    first = fitz.Pixmap(thumbnails[0][1])
+    cell_w = first.width * 72 / dpi
+    cell_h = first.height * 72 / dpi
+    # 总览图按缩略图分辨率渲染，标签字号按72/dpi换算，保证渲染后约为LABEL_PX像素高，低分辨率下也能看清订单号
+    label_size = LABEL_PX * 72 / dpi
+    label_height = label_size * 1.4
+    rows = (len(thumbnails) + columns - 1) // columns
+    sheet_w = columns * (cell_w + SHEET_GAP) + SHEET_GAP
+    sheet_h = rows * (cell_h + label_height + SHEET_GAP) + SHEET_GAP
+
+    # 在临时PDF页面上排版后整体渲染为一张图片
+    doc = fitz.open()
+    try:
+        page = doc.new_page(width=sheet_w, height=sheet_h)
+        for idx, (label, png) in enumerate(thumbnails):
+            row, col = divmod(idx, columns)
+            x = SHEET_GAP + col * (cell_w + SHEET_GAP)
+            y = SHEET_GAP + row * (cell_h + label_height + SHEET_GAP)
+            rect = fitz.Rect(x, y, x + cell_w, y + cell_h)
+            page.insert_image(rect, stream=png)
+            page.draw_rect(rect, color=(0.6, 0.6, 0.6), width=0.5)
+            page.insert_text((x, y + cell_h + label_size * 1.1), label, fontsize=label_size, color=(0, 0, 0))
+        pix = page.get_pixmap(dpi=dpi)
+    finally:
+        doc.close()
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    pix.save(output_path)
+    print(f"预览总览图已生成：{output_path}（{len(thumbnails)} 页）")
+    return output_path
+
+
+class PreviewStage:
+    """
+    后台预览阶段：输出PDF提交后在后台线程渲染缩略图，批次结束时生成一张总览图。
+
+    PyMuPDF不支持多线程并发调用，因此默认只用一个后台线程串行渲染；
+    渲染仍与主流程的提取、写出并行进行，不阻塞流水线。
+    """
+
+    def __init__(self, dpi=THUMB_DPI, cache=None, workers=1):
+        self.dpi = dpi
+        self.cache = cache if cache is not None else ThumbnailCache()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='preview')
+        self._pending = []
+
+    def submit(self, label, pdf_bytes):
+        """提交一个输出PDF，后台渲染其全部页面"""
+        future = self._pool.submit(render_thumbnails, pdf_bytes, self.dpi, self.cache)
+        self._pending.append((label, future))
+
+    def write_contact_sheet(self, output_path, columns=SHEET_COLUMNS):
+        """等待全部缩略图完成并生成总览图"""
+        thumbnails = []
+        for label, future in self._pending:
+            try:
+                pages = future.result()
+            except Exception as e:
+                print(f"预览渲染失败：{label}：{e.__class__.__name__}: {str(e)}")
+                continue
+            for page_idx, png in enumerate(pages, 1):
+                thumbnails.append((f"{label} ({page_idx}/{len(pages)})", png))
+        self._pending = []
+        result = self._pool.submit(compose_contact_sheet, thumbnails, output_path, columns, self.dpi).result()
+        print(f"缩略图缓存：命中 {self.cache.hits}，未命中 {self.cache.misses}")
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+
+def main():
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description="为输出的A5 PDF生成缩略图总览图。")
+    parser.add_argument("inputs", nargs='+', help="PDF文件或包含PDF文件的目录")
+    parser.add_argument("--out", default='contact_sheet.png', help="总览图输出路径（默认 contact_sheet.png）")
+    parser.add_argument("--dpi", type=int, default=THUMB_DPI, help=f"缩略图分辨率（默认 {THUMB_DPI}）")
+    parser.add_argument("--columns", type=int, default=SHEET_COLUMNS, help=f"每行缩略图数量（默认 {SHEET_COLUMNS}）")
+    args = parser.parse_args()
+
+    pdf_paths = []
+    for item in args.inputs:
+        if os.path.isdir(item):
+            pdf_paths.extend(sorted(glob.glob(os.path.join(item, '*.pdf'))))
+        else:
+            pdf_paths.append(item)
+
+    stage = PreviewStage(dpi=args.dpi)
+    try:
+        for path in pdf_paths:
+            with open(path, 'rb') as f:
+                stage.submit(os.path.splitext(os.path.basename(path))[0], f.read())
+        stage.write_contact_sheet(args.out, args.columns)
+    finally:
+        stage.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import io
+import os
+import time
+from pypdf import PdfReader, PdfWriter
+
+from shopify_packing_list_modifier import publish_atomic
+from metrics import METRICS
+
+
+class MergedPrintJob:
+    """
+    合并打印任务：把每个订单的A5页面依次追加到批次PDF中，并为每个订单添加书签。
+
+    每累计 flush_every 个订单就把当前批次写出为一个分卷文件（原子发布）并释放内存，
+    操作员可以在整批完成前开始打印已写出的分卷；内存占用只与 flush_every 有关，不随批次大小增长。
+    同一分卷内相同的字体、资源对象只写一份。
+    """
+
+    def __init__(self, output_dir='output', prefix=None, flush_every=20):
+        self.output_dir = output_dir
+        self.prefix = prefix or time.strftime("batch_%Y%m%d_%H%M%S")
+        self.flush_every = max(1, flush_every)
+        self.parts = []
+        self.failed_parts = []
+        self._writer = None
+        self._orders = 0
+        self._part_no = 1
+
+    @property
+    def current_part(self):
+        """当前正在累积的分卷文件路径"""
+        return os.path.join(self.output_dir, f"{self.prefix}_{self._part_no:03d}.pdf")
+
+    def add(self, order_number, pdf_bytes):
+        """
+        追加一个订单的A5页面，并在订单首页添加书签。
+
+        返回值:
+        str: 该订单所在分卷的路径（分卷在累计满flush_every个订单或close时写出）。
+        """
+        part_path = self.current_part
+        # 先解析输入，损坏的PDF不会影响当前分卷
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if self._writer is None:
+            self._writer = PdfWriter()
+        first_page = len(self._writer.pages)
+        for page in reader.pages:
+            self._writer.add_page(page)
+        self._writer.add_outline_item(f"#{order_number}", first_page)
+        self._orders += 1
+        if self._orders >= self.flush_every:
+            self.flush()
+        return part_path
+
+    def flush(self):
+        """写出当前分卷并开始新分卷，没有待写页面时直接返回；写出失败的分卷记录在failed_parts中"""
+        if self._writer is None or not self._writer.pages:
+            return None
+        writer = self._writer
+        part_path = self.current_part
+        self._writer = None
+        self._orders = 0
+        self._part_no += 1
+
+        # 合并分卷内各订单重复的字体、资源对象（旧版pypdf无此接口时跳过）
+        if hasattr(writer, 'compress_identical_objects'):
+            writer.compress_identical_objects()  # 默认即合并相同对象并删除孤立对象
+
+        try:
+            publish_atomic(writer.write, part_path)
+        except Exception:
+            METRICS.inc('merged_parts_total', status='failed')
+            self.failed_parts.append(part_path)
+            raise
+        METRICS.inc('merged_parts_total', status='ok')
+        self.parts.append(part_path)
+        print(f"合并打印分卷已生成：{part_path}")
+        return part_path
+
+    def close(self):
+        """写出最后一个分卷，返回全部分卷路径"""
+        self.flush()
+        return self.parts
@@ -1,53 +1,187 @@
 import os
+import zlib
 import time
+import shutil
+import tempfile
+import contextlib
+import functools
+import itertools
+import json
+import argparse
 import pdfplumber
 import re
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4, A5
 from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import TTFont
 from decimal import Decimal
-from pypdf import PdfReader, PdfWriter, Transformation
+from datetime import datetime
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import NameObject, RectangleObject
+from metrics import METRICS
+from pdf_index import latest_pdfs
 
 order_blk_id = 1
 customer_blk_id = 4
 item_blk_id = -1
 last_third_id = -1
 order_number = -1
+item_rows = []
 
-def select_pdf_file():
+# 商品行：行尾为数量。Shopify模板为"2 of 2"，表内出现该格式时只按该格式识别，
+# 避免把"Size 10"这类规格续行误判为商品行；否则退回到行尾单独的数字
+ITEM_OF_PATTERN = re.compile(r'^(?P<item>.*?\S)\s+(?P<qty>\d+)\s+of\s+\d+$')
+ITEM_ROW_PATTERN = re.compile(r'^(?P<item>.*?\S)\s+(?P<qty>\d+)$')
+SKU_PATTERN = re.compile(r'^SKU[:：]?\s*(?P<sku>\S+)', re.IGNORECASE)
+
+# 字体映射表：源PDF字体 -> reportlab内置字体
+FONT_MAP = {
+    'NotoSans-Regular': 'Helvetica',
+    'NotoSans-Bold': 'Helvetica-Bold',
+}
+
+# 可选：真实字体嵌入。设置环境变量 SPLM_FONT_DIR 指向包含 NotoSans-*.ttf 的目录后，
+# 源PDF中的NotoSans字体将以子集形式嵌入输出文件，而不是映射为Helvetica
+FONT_DIR = os.environ.get('SPLM_FONT_DIR')
+
+# 已注册的嵌入字体：源字体名 -> reportlab字体名（进程内只注册一次，批量/服务模式下跨订单复用）
+EMBEDDED_FONTS = {}
+
+# 模板：从参考PDF学习一次版式指纹和区域并缓存，用于校验提取结果、快速发现版式变化
+TEMPLATE_VERSION = 3    # 模板文件结构版本，结构变化时递增以使旧缓存失效
+TEMPLATE_PATH = os.environ.get(
+    'SPLM_TEMPLATE_PATH', os.path.join(os.path.expanduser('~'), '.splm_template.json')
+)
+TEMPLATE_MARGIN = 3     # 区域边界外扩（单位：pt）
+FOOTER_LINES = 3        # 页脚行数，倒数第三行为需要删除的页脚首行
+_template_cache = {}    # 进程内模板缓存：路径 -> 模板
+
+# 订单号 -> 页码索引缓存：按 (绝对路径, 大小, 修改时间) 识别文件，首次遇到时建立
+ORDER_INDEX_PATH = os.environ.get(
+    'SPLM_ORDER_INDEX_PATH', os.path.join(os.path.expanduser('~'), '.splm_order_index.json')
+)
+ORDER_NUMBER_PATTERN = re.compile(r'#\s*(\d+)')
+
+# pdfplumber文本行提取参数
+LINE_PARAMS = dict(
+    x_tolerance=1,
+    y_tolerance=1,
+    keep_blank_chars=False,
+    use_text_flow=True,
+    split_at_punctuation=False
+)
+
+# 自动适配排版参数（单位：pt）
+PAGE_MARGIN = 20        # 右侧页边距
+COLUMN_GAP = 10         # 同一行相邻文本块之间的最小间距
+MIN_FONT_RATIO = 0.75   # 缩小字号的下限（相对原字号）
+LINE_SPACING = 1.2      # 换行时的行距倍数
+
+def reset_order_state():
+    """重置上一个订单遗留的模块级状态（批量模式下同一工作进程会连续处理多个订单）"""
+    global item_blk_id, last_third_id, order_number, item_rows
+    item_blk_id = -1
+    last_third_id = -1
+    order_number = -1
+    item_rows = []
+
+class JobFailed(Exception):
+    """转换阶段返回失败结果（None/False）时抛出，使job_workspace保留工作目录"""
+
+@contextlib.contextmanager
+def job_workspace(base_dir=None, keep=False):
+    """
+    为单次转换任务创建独立的临时工作目录，任务结束后自动清理。
+
+    每个任务的中间文件（元数据txt、A4中间PDF）都写入各自的目录，
+    多个进程同时转换时互不覆盖。任务异常退出时保留目录以便排查；
+    各阶段函数自行捕获异常并返回None/False，调用方需对失败结果抛出JobFailed。
+
+    参数:
+    base_dir (str): 临时目录的父目录，默认使用系统临时目录。
+    keep (bool): 为True时任务成功后也保留工作目录。
+
+    返回值:
+    str: 工作目录路径。
+    """
+    work_dir = tempfile.mkdtemp(prefix='splm_job_', dir=base_dir)
+    try:
+        yield work_dir
+    except BaseException:
+        print(f"任务失败，已保留工作目录：{work_dir}")
+        raise
+    else:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def publish_atomic(write_func, final_path):
+    """
+    以原子重命名的方式发布最终输出文件。
+
+    先把内容写入与目标文件同目录的临时文件，再用os.replace整体替换，
+    其他进程要么看到旧文件，要么看到完整的新文件，不会读到写了一半的内容。
+
+    参数:
+    write_func (callable): 接收已打开的二进制文件对象并写入内容的函数。
+    final_path (str): 最终输出文件路径。
+
+    返回值:
+    str: 最终输出文件路径。
+    """
+    output_dir = os.path.dirname(final_path) or '.'
+    os.makedirs(output_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(final_path)}.", suffix='.part', dir=output_dir
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_func(f)
+        os.replace(tmp_path, final_path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return final_path
+
+def select_pdf_file(directory='.', limit=20, since=None, order=None):
     """
     获取并处理当前目录下的PDF文件。
 
     该函数会扫描当前目录下的所有PDF文件，并按修改时间从新到旧排序。用户可以选择最新的文件或从列表中选择其他文件。
+    扫描基于os.scandir和持久索引，只取最新的limit个文件，下载目录中文件很多时也不会逐个stat。
+
+    参数:
+    directory (str): 扫描的目录。
+    limit (int): 列表中显示的最新文件数量，为0时显示全部。
+    since (str): 只显示该日期（YYYY-MM-DD）及之后的文件。
+    order (str): 只显示文件名中包含该订单号的文件。
 
     返回值:
         str: 用户选择的PDF文件路径。如果未找到PDF文件或用户取消选择，则返回None。
     """
     
-    # 获取当前目录所有PDF文件（不区分大小写）
-    pdf_files = [f for f in os.listdir() if f.lower().endswith('.pdf')]
+    # 获取最新的PDF文件（不区分大小写），按修改时间从新到旧排序
+    pdf_files = latest_pdfs(directory, k=limit or None, since=since, order=order)
     
     # 无PDF文件处理
     if not pdf_files:
         print("错误：当前目录下未找到PDF文件")
         return None
     
-    # 按修改时间从新到旧排序（完整排序版）
-    pdf_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
-    
     # 尝试选择最新文件
-    latest_file = pdf_files[0]
-    user_choice = input(f"发现最新PDF文件：{latest_file}\n直接按Enter选择该文件，输入n查看全部列表：").strip().lower()
+    latest_file = os.path.join(directory, pdf_files[0][0])
+    user_choice = input(f"发现最新PDF文件：{pdf_files[0][0]}\n直接按Enter选择该文件，输入n查看全部列表：").strip().lower()
     
     # 直接选择最新文件
     if user_choice in ('', 'y', 'yes'):
         return latest_file
     
-    # 显示完整文件列表
-    print("\n当前目录PDF文件列表：")
-    for index, file in enumerate(pdf_files, 1):
+    # 显示文件列表（复用扫描得到的修改时间，不再重复stat）
+    print(f"\n当前目录最新的 {len(pdf_files)} 个PDF文件：")
+    for index, (file, mtime, _) in enumerate(pdf_files, 1):
         # 获取人类可读的修改时间
-        mtime = os.path.getmtime(file)
         formatted_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
         print(f"[{index}] {file}（最后修改：{formatted_time}）")
     
@@ -64,7 +198,7 @@ def select_pdf_file():
         try:
             index = int(selection)
             if 1 <= index <= len(pdf_files):
-                return pdf_files[index-1]
+                return os.path.join(directory, pdf_files[index-1][0])
             print("错误：编号超出范围")
         except ValueError:
             print("错误：请输入有效数字")
@@ -114,12 +248,362 @@ def write_metadata_to_file(metadata, output_dir, file_name):
 
     # 打印成功信息
     print(f"新元数据文件已生成：{output_path}")
-def extract_text_with_metadata(pdf_path):
+def build_line_metadata(text_objects, page_num, start_id):
+    """
+    将pdfplumber文本行对象转换为元数据列表。
+
+    参数:
+    text_objects (list): extract_text_lines返回的文本行对象。
+    page_num (int): 页码（从1开始）。
+    start_id (int): 第一个文本对象的ID。
+
+    返回值:
+    list: 元数据列表。
+    """
+    metadata = []
+    for text_id, obj in enumerate(text_objects, start_id):
+        # 获取字符级属性，如字体、字号等
+        font_info = obj.get('chars', [{}])[0] if obj.get('chars') else {}
+        
+        # 构建当前文本对象的元数据字典
+        metadata.append({
+            "ID": text_id,  # 新增唯一ID
+            "页码": page_num,
+            "文本": obj.get('text', ''),
+            "字体": font_info.get('fontname', '未知字体'),
+            "字号": round(font_info.get('size', 0), 1),
+            "位置": (round(obj.get('x0', 0)), round(obj.get('top', 0), 1)),
+            "宽度": round(obj.get('width', 0), 1)
+        })
+    return metadata
+
+def load_template(template_path=TEMPLATE_PATH):
+    """读取模板文件（进程内缓存），不存在或版本不符时返回None"""
+    if template_path in _template_cache:
+        return _template_cache[template_path]
+    try:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            template = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if template.get('schema') != TEMPLATE_VERSION:
+        print(f"模板文件版本不符（{template.get('schema')} != {TEMPLATE_VERSION}），将重新学习")
+        return None
+    _template_cache[template_path] = template
+    return template
+
+def learn_template(page, text_objects, template_path=TEMPLATE_PATH, previous=None):
+    """
+    从参考页的完整提取结果中学习模板区域并保存。
+
+    模板把页面按锚点划分为四个区域，均取整个页面宽度，避免较长的地址、商品名被裁掉：
+    - header：订单号、SHIP TO、客户姓名等固定位置的块，记录绝对坐标，建立订单索引时只提取该区域
+    - SHIP TO段：header下沿到ITEMS QUANTITY锚点之间的地址行，长度随订单变化
+    - 商品表：从ITEMS QUANTITY锚点到页脚，锚点按记录的x坐标和字体在字符中定位
+    - 页脚：最后几行，按最低字符下沿向上的固定高度定位
+    同时记录页面尺寸和锚点文本/字体作为指纹，用于快速发现Shopify版式变化。
+
+    参数:
+    page: pdfplumber页面对象。
+    text_objects (list): 该页完整提取的文本行对象。
+    template_path (str): 模板文件保存路径。
+    previous (dict): 旧模板，存在时修订号在其基础上递增。
+
+    返回值:
+    dict: 学习到的模板；锚点不足时返回None。
+    """
+    if len(text_objects) <= customer_blk_id + FOOTER_LINES + 1:
+        return None
+
+    ship_to_id = next(
+        (i for i, obj in enumerate(text_objects) if 'SHIP TO' in obj.get('text', '')), None
+    )
+    items_id = next(
+        (i for i, obj in enumerate(text_objects) if obj.get('text', '').strip() == 'ITEMS QUANTITY'),
+        None
+    )
+    footer_id = len(text_objects) - FOOTER_LINES
+    if ship_to_id is None or items_id is None or not customer_blk_id < items_id < footer_id:
+        return None
+
+    def font_of(obj):
+        chars = obj.get('chars') or [{}]
+        return chars[0].get('fontname', '').split('+')[-1]
+
+    # 区域边界取相邻两行间隙的中点
+    header_objs = text_objects[:customer_blk_id + 1]
+    next_top = text_objects[customer_blk_id + 1]['top']
+    header_bottom = (max(obj['bottom'] for obj in header_objs) + next_top) / 2
+    header_top = max(0, min(obj['top'] for obj in header_objs) - TEMPLATE_MARGIN)
+    items_obj = text_objects[items_id]
+    items_boundary = (text_objects[items_id - 1]['bottom'] + items_obj['top']) / 2
+    footer_boundary = (text_objects[footer_id - 1]['bottom'] + text_objects[footer_id]['top']) / 2
+    page_bottom = max(obj['bottom'] for obj in text_objects)
+
+    template = {
+        'schema': TEMPLATE_VERSION,
+        'revision': (previous or {}).get('revision', 0) + 1,
+        'page_size': [round(page.width, 1), round(page.height, 1)],
+        'fingerprint': {
+            'ship_to_id': ship_to_id,
+            'ship_to_text': text_objects[ship_to_id]['text'],
+            'order_font': font_of(text_objects[order_blk_id]),
+            'customer_font': font_of(text_objects[customer_blk_id]),
+        },
+        'regions': {
+            'header': [0, header_top, page.width, header_bottom],
+        },
+        'anchors': {
+            # 商品表锚点：首字符的x坐标和字体，以及区域上边界相对锚点顶部的距离
+            'items': {
+                'text': items_obj['text'],
+                'x0': items_obj['x0'],
+                'font': font_of(items_obj),
+                'offset': items_obj['top'] - items_boundary,
+            },
+            # 页脚锚点：首行文本，以及区域上边界相对最低字符下沿的距离
+            'footer': {
+                'text': text_objects[footer_id]['text'],
+                'offset': page_bottom - footer_boundary,
+            },
+        },
+    }
+
+    try:
+        # 原子写入，避免多个进程同时学习时读到写了一半的模板
+        content = json.dumps(template, ensure_ascii=False, indent=2).encode('utf-8')
+        publish_atomic(lambda f: f.write(content), template_path)
+    except OSError as e:
+        print(f"警告：模板保存失败 {template_path}：{e.__class__.__name__}: {str(e)}")
+    _template_cache[template_path] = template
+    print(f"模板已学习（修订号 {template['revision']}）：{template_path}")
+    return template
+
+def validate_template_metadata(metadata, template):
+    """检查按模板区域提取的元数据是否与模板指纹一致"""
+    fingerprint = template['fingerprint']
+    ship_to_id = fingerprint['ship_to_id']
+    if len(metadata) <= max(customer_blk_id, ship_to_id) + 3:
+        return False
+    if '#' not in metadata[order_blk_id]['文本']:
+        return False
+    if metadata[ship_to_id]['文本'] != fingerprint['ship_to_text']:
+        return False
+    if metadata[order_blk_id]['字体'].split('+')[-1] != fingerprint['order_font']:
+        return False
+    if metadata[customer_blk_id]['字体'].split('+')[-1] != fingerprint['customer_font']:
+        return False
+    return any(meta['文本'].strip() == 'ITEMS QUANTITY' for meta in metadata)
+
+def find_items_anchor(chars, anchor, top_limit):
+    """在字符流中定位商品表锚点（按记录的x坐标和字体匹配首字符），返回其顶部坐标"""
+    for char in chars:
+        if (char['text'] == anchor['text'][0] and char['top'] > top_limit
+                and abs(char['x0'] - anchor['x0']) <= 1
+                and char['fontname'].split('+')[-1] == anchor['font']):
+            return char['top']
+    return None
+
+def group_span_lines(chars):
+    """
+    把SHIP TO段的字符按行分组（字符流中相邻且顶部坐标相近的字符为同一行）。
+
+    地址行随后会被删除，只用于占位和调试输出，因此不做单词聚类，文本直接拼接字符。
+    """
+    groups = []
+    for char in chars:
+        if groups and abs(char['top'] - groups[-1][0]['top']) <= LINE_PARAMS['y_tolerance']:
+            groups[-1].append(char)
+        else:
+            groups.append([char])
+    return [{
+        'text': ''.join(char['text'] for char in group).strip(),
+        'x0': min(char['x0'] for char in group),
+        'top': group[0]['top'],
+        'bottom': max(char['bottom'] for char in group),
+        'chars': group,
+    } for group in groups]
+
+def extract_with_template(pdf, template):
+    """
+    按模板锚点划分区域提取文本行，并用锚点做低成本校验。
+
+    首页按header下沿和商品表锚点定位SHIP TO段，段内除最后的国家行外都会被删除，只按行分组占位，
+    其余字符仍按原字符流顺序一次聚类成行，不裁剪页面。以下情况视为版式变化：
+    header上方出现字符、找不到商品表锚点、国家行之后不是商品表表头、
+    末页按最低字符下沿定位的页脚区域内不是模板记录的页脚行。
+
+    返回值:
+    list: 元数据列表；页面尺寸不符或任一锚点校验失败时返回None。
+    """
+    _, header_top, _, header_bottom = template['regions']['header']
+    items_anchor = template['anchors']['items']
+    footer_anchor = template['anchors']['footer']
+    last_page = pdf.pages[-1].page_number
+    metadata = []
+    for page_idx, page in enumerate(pdf.pages):
+        if [round(page.width, 1), round(page.height, 1)] != template['page_size']:
+            return None
+        chars = page.chars
+        if not chars:
+            return None
+
+        span_lines = []
+        if page_idx == 0:
+            items_top = find_items_anchor(chars, items_anchor, header_bottom)
+            if items_top is None:
+                return None
+            span_bottom = items_top - items_anchor['offset']
+            span = [char for char in chars if header_bottom <= char['top'] < span_bottom]
+            if not span:
+                return None
+            # 国家行保留，与其余字符一起完整聚类
+            span_lines = group_span_lines(span)
+            country_top = span_lines.pop()['top'] - LINE_PARAMS['y_tolerance']
+            chars = [char for char in chars if not header_bottom <= char['top'] < country_top]
+
+        text_objects = pdfplumber.utils.chars_to_textmap(chars, **LINE_PARAMS).extract_text_lines()
+        if page_idx == 0:
+            country_id = next(
+                (i for i, obj in enumerate(text_objects) if obj['top'] >= header_bottom), len(text_objects)
+            )
+            if country_id + 1 >= len(text_objects) or text_objects[country_id + 1]['text'] != items_anchor['text']:
+                return None
+            if min(obj['top'] for obj in text_objects) < header_top:
+                return None
+            text_objects[country_id:country_id] = span_lines
+        if page.page_number == last_page:
+            if len(text_objects) <= FOOTER_LINES:
+                return None
+            footer_top = max(obj['bottom'] for obj in text_objects) - footer_anchor['offset']
+            footer = text_objects[-FOOTER_LINES]
+            if (footer['text'] != footer_anchor['text'] or footer['top'] < footer_top
+                    or text_objects[-FOOTER_LINES - 1]['top'] >= footer_top):
+                return None
+        metadata.extend(build_line_metadata(text_objects, page.page_number, len(metadata)))
+    if not validate_template_metadata(metadata, template):
+        return None
+    return metadata
+
+def parse_page_spec(spec, page_count=None):
+    """
+    解析页码范围，如 "1-3,7"。
+
+    参数:
+    spec (str): 逗号分隔的页码或页码范围（从1开始）。
+    page_count (int): 文档总页数，提供时检查页码是否超出范围。
+
+    返回值:
+    list: 去重并排序后的页码列表（从1开始）。
+
+    异常:
+    ValueError: 页码格式无效、范围反向或超出文档页数时抛出。
+    """
+    pages = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = (int(v) for v in part.split('-', 1))
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"无效的页码范围：{spec}") from None
+        if start < 1 or start > end:
+            raise ValueError(f"无效的页码范围：{part}")
+        if page_count is not None and end > page_count:
+            raise ValueError(f"页码超出范围：{part}（文档共 {page_count} 页）")
+        pages.update(range(start, end + 1))
+    if not pages:
+        raise ValueError(f"无效的页码范围：{spec}")
+    return sorted(pages)
+
+def file_signature(pdf_path):
+    """文件标识：(绝对路径, 大小, 修改时间)，文件变化后旧索引自动失效"""
+    stat = os.stat(pdf_path)
+    return f"{os.path.abspath(pdf_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+def build_order_index(pdf_path):
+    """
+    扫描每页页眉区域中的订单号，建立 订单号 -> 页码列表 的索引。
+
+    只提取页眉区域（有模板时使用模板header区域，否则取页面上方四分之一），
+    没有订单号的续页归入上一个订单。
+
+    参数:
+    pdf_path (str): PDF文件路径。
+
+    返回值:
+    dict: 订单号 -> 页码列表（从1开始）。
+    """
+    template = load_template()
+    index = {}
+    current = None
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages:
+            if template is not None:
+                bbox = tuple(template['regions']['header'])
+            else:
+                bbox = (0, 0, page.width, page.height / 4)
+            match = ORDER_NUMBER_PATTERN.search(page.crop(bbox).extract_text() or '')
+            if match:
+                current = match.group(1)
+            if current is not None:
+                index.setdefault(current, []).append(page.page_number)
+    return index
+
+def lookup_order_pages(pdf_path, order, index_path=ORDER_INDEX_PATH):
+    """
+    查询订单所在页码，索引按文件缓存，首次查询时建立。
+
+    参数:
+    pdf_path (str): PDF文件路径。
+    order (str): 订单号（可带#）。
+    index_path (str): 索引缓存文件路径。
+
+    返回值:
+    list: 页码列表（从1开始）；订单不存在时返回None。
+    """
+    signature = file_signature(pdf_path)
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            indexes = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        indexes = {}
+
+    index = indexes.get(signature)
+    if index is None:
+        METRICS.inc('order_index_lookups_total', result='miss')
+        print(f"首次处理该文件，正在建立订单索引：{pdf_path}")
+        index = build_order_index(pdf_path)
+        # 丢弃同一路径的旧版本索引
+        path_prefix = signature.rsplit('|', 2)[0] + '|'
+        indexes = {k: v for k, v in indexes.items() if not k.startswith(path_prefix)}
+        indexes[signature] = index
+        try:
+            content = json.dumps(indexes, ensure_ascii=False).encode('utf-8')
+            publish_atomic(lambda f: f.write(content), index_path)
+        except OSError as e:
+            print(f"警告：订单索引保存失败 {index_path}：{e.__class__.__name__}: {str(e)}")
+    else:
+        METRICS.inc('order_index_lookups_total', result='hit')
+
+    return index.get(str(order).lstrip('#'))
+
+def extract_text_with_metadata(pdf_path, work_dir='tmp', use_template=True, pages=None):
     """
     从指定的PDF文件中提取文本及其元数据，并为每个文本对象生成唯一编号。
 
+    启用模板时按模板区域提取并校验版式指纹，校验失败（例如Shopify版式变化）时回退到整页提取，
+    并用当前文件重新学习模板。
+
     参数:
     - pdf_path (str): PDF文件的路径。
+    - work_dir (str): 中间文件的输出目录。
+    - use_template (bool): 是否使用模板区域提取。
+    - pages (list): 只提取指定页码（从1开始），通过页面树随机访问加载；为None时提取全部页面。
 
     返回值:
     - list: 包含每个文本对象元数据的列表。每个元数据包括唯一ID、页码、文本内容、字体、字号、位置和宽度等信息。
@@ -128,47 +612,33 @@ def extract_text_with_metadata(pdf_path):
 
     try:
         # 使用pdfplumber打开PDF文件
-        with pdfplumber.open(pdf_path) as pdf:      
-            # 全局唯一ID计数器，初始化为-1，每次提取文本时自增
-            text_id = -1
-            # 用于存储所有文本对象的元数据
-            metadata = []
-            
-            # 遍历PDF的每一页
-            for page_num, page in enumerate(pdf.pages, 1):
-                # 提取当前页的文本行对象
-                text_objects = page.extract_text_lines(
-                    x_tolerance=1,
-                    y_tolerance=1,
-                    keep_blank_chars=False,
-                    use_text_flow=True,
-                    split_at_punctuation=False
-                )
+        with pdfplumber.open(pdf_path, pages=pages) as pdf:      
+            metadata = None
+            template = load_template() if use_template else None
+            if template is not None:
+                metadata = extract_with_template(pdf, template)
+                if metadata is None:
+                    print(f"警告：模板（修订号 {template.get('revision')}）校验失败，可能是版式变化，回退到整页提取")
+                METRICS.inc('template_lookups_total', result='miss' if metadata is None else 'hit')
+
+            if metadata is None:
+                # 用于存储所有文本对象的元数据
+                metadata = []
                 
-                # 遍历当前页的每个文本对象
-                for obj in text_objects:
-                    text_id += 1  # 全局自增ID
-                    
-                    # 获取字符级属性，如字体、字号等
-                    font_info = obj.get('chars', [{}])[0] if obj.get('chars') else {}
-                    
-                    # 构建当前文本对象的元数据字典
-                    meta = {
-                        "ID": text_id,  # 新增唯一ID
-                        "页码": page_num,
-                        "文本": obj.get('text', ''),
-                        "字体": font_info.get('fontname', '未知字体'),
-                        "字号": round(font_info.get('size', 0), 1),
-                        "位置": (round(obj.get('x0', 0)), round(obj.get('top', 0), 1)),
-                        "宽度": round(obj.get('width', 0), 1)
-                    }
-                    # 将元数据添加到列表中
-                    metadata.append(meta)
+                # 遍历PDF的每一页
+                for page_idx, page in enumerate(pdf.pages):
+                    # 提取当前页的文本行对象
+                    text_objects = page.extract_text_lines(**LINE_PARAMS)
+                    metadata.extend(build_line_metadata(text_objects, page.page_number, len(metadata)))
+
+                    # 用第一页重新学习模板
+                    if use_template and page_idx == 0:
+                        learn_template(page, text_objects, previous=template)
 
         # 从元数据中提取订单号，并写入文件
         global order_number
         order_number = metadata[order_blk_id]['文本'].split('#')[-1] 
-        output_dir = 'tmp'
+        output_dir = work_dir
         file_name = f"{order_number}_extracted"
         write_metadata_to_file(metadata, output_dir, file_name)
         print(f"写入元数据文件成功：{output_dir}/{file_name}.txt")
@@ -225,6 +695,10 @@ def analyze_metadata(metadata):
             delete_ids.append(last_third_id)
         else:
             print("警告：总块数不足，无法获取倒数第三块")
+
+        # 复用本次提取结果解析商品表，供批量拣货单汇总
+        global item_rows
+        item_rows = parse_item_rows(metadata, item_blk_id, last_third_id)
         
         # 打印待删除内容的信息
         print("\n=== 待删除内容 ===")
@@ -237,13 +711,50 @@ def analyze_metadata(metadata):
 
     except KeyError as e:
         print(f"关键数据缺失：ID{e.args[0]} 不存在")
-def create_new_metadata(metadata, delete_ids):
+def parse_item_rows(metadata, start_id, end_id):
+    """
+    解析ITEMS QUANTITY与页脚之间的商品表。
+
+    以"名称 + 行尾数量"的行作为新商品，之后不带数量的行视为该商品的续行：
+    "SKU: xxx" 记录为SKU，其他（如规格"M / Black"）追加到商品名称中。
+
+    参数:
+    metadata (list): 提取得到的元数据列表。
+    start_id (int): ITEMS QUANTITY块的ID。
+    end_id (int): 页脚（倒数第三块）的ID，不包含在商品表内。
+
+    返回值:
+    list: 商品行列表，每项为 {'item': 名称, 'sku': SKU或'', 'quantity': 数量}。
+    """
+    rows = []
+    lines = [meta.get('文本', '').strip() for meta in metadata[start_id + 1:end_id]]
+    pattern = ITEM_OF_PATTERN if any(ITEM_OF_PATTERN.match(text) for text in lines) else ITEM_ROW_PATTERN
+    for text in lines:
+        if not text:
+            continue
+        sku_match = SKU_PATTERN.match(text)
+        if sku_match and rows:
+            rows[-1]['sku'] = sku_match.group('sku')
+            continue
+        row_match = pattern.match(text)
+        if row_match:
+            rows.append({
+                'item': row_match.group('item'),
+                'sku': '',
+                'quantity': int(row_match.group('qty')),
+            })
+        elif rows:
+            rows[-1]['item'] = f"{rows[-1]['item']} {text}"
+    return rows
+
+def create_new_metadata(metadata, delete_ids, work_dir='tmp'):
     """
     生成新元数据文件，新增区域和国家信息块，并删除指定ID的块。
 
     参数:
     - metadata (list): 包含多个字典的列表，每个字典代表一个元数据块。
     - delete_ids (list): 需要删除的元数据块的ID列表。
+    - work_dir (str): 中间文件的输出目录。
 
     返回值:
     - list: 处理后的元数据列表，包含新增的区域和国家信息块，并删除了指定ID的块。
@@ -328,13 +839,13 @@ def create_new_metadata(metadata, delete_ids):
             break
 
     # 生成新文件
-    output_dir = 'tmp'
+    output_dir = work_dir
     file_name = f"{order_number}_modified"
     write_metadata_to_file(metadata, output_dir, file_name)
     print(f"写入元数据文件成功：{output_dir}/{file_name}.txt")
 
     return metadata
-def adjust_metadata_positions(metadata):
+def adjust_metadata_positions(metadata, work_dir='tmp'):
     """
     调整内容块位置并保留完整元数据。
 
@@ -343,6 +854,7 @@ def adjust_metadata_positions(metadata):
 
     参数:
     metadata (dict): 包含所有内容块及其位置信息的元数据字典。
+    work_dir (str): 中间文件的输出目录。
 
     返回值:
     dict: 调整位置后的元数据字典。
@@ -368,17 +880,165 @@ def adjust_metadata_positions(metadata):
         block['位置'] = (x, y + y_offset)
 
     # 生成完整元数据文件
-    output_dir = 'tmp'
+    output_dir = work_dir
     file_name = f"{order_number}_adjusted"
     write_metadata_to_file(metadata, output_dir, file_name)
     print(f"写入元数据文件成功：{output_dir}/{file_name}.txt")
     return metadata
-def generate_new_pdf(metadata):
+def register_embedded_fonts(font_dir=FONT_DIR):
+    """
+    注册需要嵌入的TTF字体，每个进程只解析一次字体文件。
+
+    reportlab对TTF字体按子集嵌入，输出文件中只包含实际用到的字形。
+    找不到字体文件时保持Helvetica映射，不影响正常转换。
+
+    参数:
+    font_dir (str): 字体文件目录，为None时不启用嵌入。
+
+    返回值:
+    dict: 已注册的 源字体名 -> reportlab字体名 映射。
+    """
+    if not font_dir:
+        return EMBEDDED_FONTS
+
+    for font_key in FONT_MAP:
+        if font_key in EMBEDDED_FONTS:
+            continue
+        font_path = os.path.join(font_dir, f"{font_key}.ttf")
+        if not os.path.isfile(font_path):
+            print(f"警告：未找到字体文件 {font_path}，继续使用 {FONT_MAP[font_key]}")
+            continue
+        try:
+            pdfmetrics.registerFont(TTFont(font_key, font_path))
+        except Exception as e:
+            print(f"警告：字体注册失败 {font_path}：{e.__class__.__name__}: {str(e)}")
+            continue
+        EMBEDDED_FONTS[font_key] = font_key
+
+    # 字体映射发生变化，清空依赖字体的缓存
+    resolve_font.cache_clear()
+    text_width.cache_clear()
+    return EMBEDDED_FONTS
+
+@functools.lru_cache(maxsize=None)
+def resolve_font(font_field):
+    """
+    将pdfplumber提取的字体名（如'ABCDEF+NotoSans-Bold'）解析为reportlab字体名，结果缓存。
+
+    已注册嵌入字体时优先使用嵌入字体，否则映射为内置字体。
+
+    参数:
+    font_field (str): 元数据中的字体字段。
+
+    返回值:
+    str: reportlab可用的字体名。
+    """
+    font_key = font_field.split('+')[-1]
+    if font_key in EMBEDDED_FONTS:
+        return EMBEDDED_FONTS[font_key]
+    return FONT_MAP.get(font_key, 'Helvetica')
+
+def block_font(block):
+    """返回文本块绘制时使用的 (字体名, 字号)"""
+    return resolve_font(block.get('字体', 'Helvetica')), block.get('字号', 10)
+
+@functools.lru_cache(maxsize=4096)
+def text_width(font_name, font_size, text):
+    """测量文本宽度，按 (字体, 字号, 文本) 缓存，批量订单中重复的国家名/字体只计算一次"""
+    return stringWidth(text, font_name, font_size)
+
+def wrap_text(text, font_name, font_size, max_width):
+    """按单词贪心换行，返回不超过max_width的行列表（单个超长单词单独成行）"""
+    lines = []
+    current = ''
+    for word in text.split():
+        candidate = f"{current} {word}" if current else word
+        if current and text_width(font_name, font_size, candidate) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+def fit_metadata_to_page(metadata):
+    """
+    排版适配：测量每个文本块的实际宽度，超出可用宽度时先缩小字号，仍然超出则换行。
+
+    可用宽度取同一行右侧最近文本块的起点（减去间距），没有右侧文本块时取页面右边距。
+    垂直方向相距小于字号（文字范围重叠）的文本块视为同一行，例如客户姓名与右侧略有错位的国家块。
+    换行增加的高度会使同一页中位于该块下方的所有文本块整体下移，避免与下方的国家块、商品表重叠。
+
+    参数:
+    metadata (list): 调整位置后的元数据列表。
+
+    返回值:
+    list: 适配后的元数据列表，换行产生的新块紧跟在原块之后。
+    """
+    page_width, _ = A4
+    fitted = []
+    continuation_blocks = []
+    for block in metadata:
+        text = block.get('文本', '')
+        x, y = block.get('位置', (0, 0))
+        font_name, font_size = block_font(block)
+
+        # 计算可用宽度
+        right_edges = [
+            other['位置'][0] for other in metadata
+            if other is not block and abs(other['位置'][1] - y) < font_size and other['位置'][0] > x
+        ]
+        limit = (min(right_edges) - COLUMN_GAP) if right_edges else (page_width - PAGE_MARGIN)
+        max_width = limit - x
+
+        width = text_width(font_name, font_size, text)
+        if width <= max_width:
+            block['宽度'] = round(width, 1)
+            fitted.append(block)
+            continue
+
+        # 先尝试缩小字号
+        min_size = round(font_size * MIN_FONT_RATIO, 1)
+        new_size = max(min_size, round(font_size * max_width / width, 1))
+        block['字号'] = new_size
+        width = text_width(font_name, new_size, text)
+        if width <= max_width:
+            print(f"排版适配：'{text[:30]}' 字号 {font_size} -> {new_size}")
+            block['宽度'] = round(width, 1)
+            fitted.append(block)
+            continue
+
+        # 缩到下限仍超出，按单词换行
+        lines = wrap_text(text, font_name, new_size, max_width)
+        print(f"排版适配：'{text[:30]}' 字号 {font_size} -> {new_size}，换行为 {len(lines)} 行")
+        for line_no, line in enumerate(lines):
+            line_block = block if line_no == 0 else dict(block)
+            line_block['文本'] = line
+            line_block['位置'] = (x, y + line_no * new_size * LINE_SPACING)
+            line_block['宽度'] = round(text_width(font_name, new_size, line), 1)
+            fitted.append(line_block)
+
+        # 下方各行整体下移换行增加的高度（整行移动，保持商品名与数量等同行文本对齐）
+        extra_height = (len(lines) - 1) * new_size * LINE_SPACING
+        for other in itertools.chain(metadata, continuation_blocks):
+            if other['页码'] == block['页码'] and other['位置'][1] >= y + font_size:
+                other_x, other_y = other['位置']
+                other['位置'] = (other_x, other_y + extra_height)
+        continuation_blocks.extend(fitted[len(fitted) - len(lines) + 1:])
+
+    # 重新编号
+    for idx, meta in enumerate(fitted):
+        meta['ID'] = idx
+    return fitted
+
+def generate_new_pdf(metadata, work_dir='tmp'):
     """
     根据元数据生成A4尺寸的PDF文件。
 
     参数:
     metadata (list)
+    work_dir (str): 中间PDF的输出目录。
 
     返回值:
     str: 生成的PDF文件路径。如果生成过程中出现错误，则返回None。
@@ -387,7 +1047,7 @@ def generate_new_pdf(metadata):
     page_width, page_height = A4
 
     # 创建输出目录（保持不变）
-    output_dir = 'tmp'
+    output_dir = work_dir
     try:
         os.makedirs(output_dir, exist_ok=True)
     except PermissionError:
@@ -397,42 +1057,86 @@ def generate_new_pdf(metadata):
     pdf_name = f"{order_number}.pdf"
     pdf_path = os.path.join(output_dir, pdf_name)    
     
+    render_start = time.perf_counter()
+
     # 创建PDF画布，并应用A4尺寸
     c = canvas.Canvas(pdf_path, pagesize=(page_width, page_height))  # 修改点2：应用A4尺寸
     
-    # 字体映射表（保持不变）
-    FONT_MAP = {
-        'NotoSans-Regular': 'Helvetica',
-        'NotoSans-Bold': 'Helvetica-Bold',
-    }
-    
-    # 遍历元数据中的每个文本块，并在PDF上绘制
-    for block in metadata:
-        x, y = block.get('位置', (0, 0))
-        
-        font_key = block.get('字体', 'Helvetica').split('+')[-1]
-        font_name = FONT_MAP.get(font_key, 'Helvetica')
-        font_size = block.get('字号', 10)
-        
-        c.setFont(font_name, font_size)
-        c.drawString(x, page_height - y, block.get('文本', ''))  # 保持Y轴转换逻辑
+    # 按字体分组绘制：连续使用相同字体的块合并到同一个文本对象（单个BT/ET）中
+    for (font_name, font_size), blocks in itertools.groupby(metadata, key=block_font):
+        text_obj = c.beginText()
+        text_obj.setFont(font_name, font_size)
+        for block in blocks:
+            x, y = block.get('位置', (0, 0))
+            text_obj.setTextOrigin(x, page_height - y)  # 保持Y轴转换逻辑
+            text_obj.textOut(block.get('文本', ''))
+        c.drawText(text_obj)
     
     # 保存PDF文件
     c.save()
-    print(f"新PDF生成成功：{pdf_path}")
+    render_ms = (time.perf_counter() - render_start) * 1000
+    print(f"新PDF生成成功：{pdf_path}（渲染耗时 {render_ms:.1f}ms，文件大小 {os.path.getsize(pdf_path)} 字节）")
     return pdf_path
 
-def split_a4_to_a5_vertical(input_pdf_path):
+def build_a5_writer(input_pdf_path):
+    """
+    将A4页面拆分为上下两个A5页面，返回尚未写出的PdfWriter。
+
+    参数:
+    input_pdf_path (str): 输入的A4尺寸PDF文件路径（也可以是二进制文件对象）。
+
+    返回值:
+    tuple: (PdfWriter, 节省的字节数估计)。
+    """
+    reader = PdfReader(input_pdf_path)
+    writer = PdfWriter()
+
+    # 定义标准尺寸（单位：点）
+    A4_WIDTH, A4_HEIGHT = A4
+    A5_HEIGHT = A4_HEIGHT / 2  # 420.945pt
+
+    saved_bytes = 0
+    for page in reader.pages:
+        # ==================================================================
+        # 处理上半部分：页面只导入一次，通过MediaBox取原页面上半部分
+        # ==================================================================
+        top_page = writer.add_page(page)
+        contents = top_page.get_contents()
+        raw_data = contents.get_data() if contents is not None else b''
+        top_page.compress_content_streams()  # 压缩内容流
+        top_page.mediabox = RectangleObject((0, A5_HEIGHT, A4_WIDTH, A4_HEIGHT))
+        top_page.cropbox = RectangleObject((0, A5_HEIGHT, A4_WIDTH, A4_HEIGHT))
+
+        # ==================================================================
+        # 处理下半部分：与上半部分共享同一份内容流和资源，不再重复克隆
+        # ==================================================================
+        bottom_page = writer.add_blank_page(width=A4_WIDTH, height=A5_HEIGHT)
+        for key in ('/Contents', '/Resources'):
+            if key in top_page:
+                bottom_page[NameObject(key)] = top_page.raw_get(key)
+
+        # 估算节省的字节数：原实现每个A5页各合并一份未压缩的内容流，现在只写一份Flate压缩流
+        # （用zlib压缩长度近似pypdf写出的压缩流长度）
+        if raw_data:
+            saved_bytes += 2 * len(raw_data) - len(zlib.compress(raw_data))
+
+    # 跨页面合并相同的字体、资源等对象（旧版pypdf无此接口时跳过）
+    if hasattr(writer, 'compress_identical_objects'):
+        writer.compress_identical_objects()  # 默认即合并相同对象并删除孤立对象
+
+    return writer, saved_bytes
+
+def split_a4_to_a5_vertical(input_pdf_path, output_dir='output'):
     """
     将A4尺寸的PDF文件垂直分割为两个A5尺寸的PDF文件，并保存到指定目录。
 
     参数:
     input_pdf_path (str): 输入的A4尺寸PDF文件路径。
+    output_dir (str): 最终输出目录，文件通过原子重命名发布。
 
     返回值:
     bool: 如果分割成功返回True，否则返回False。
     """
-    output_dir = 'output'
     try:
         os.makedirs(output_dir, exist_ok=True)
     except PermissionError:
@@ -443,85 +1147,120 @@ def split_a4_to_a5_vertical(input_pdf_path):
     output_pdf_path = os.path.join(output_dir, pdf_name)
 
     try:
-        os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
-        
-        reader = PdfReader(input_pdf_path)
-        writer = PdfWriter()
-
-        # 定义标准尺寸（单位：点）
-        A4_WIDTH, A4_HEIGHT = A4
-        A5_HEIGHT = A4_HEIGHT / 2  # 420.945pt
-
-        for page in reader.pages:
-            # ==================================================================
-            # 处理上半部分 (关键修正点)
-            # ==================================================================
-            # 1. 创建新A5页面
-            top_page = writer.add_blank_page(width=A4_WIDTH, height=A5_HEIGHT)
-            
-            # 2. 克隆原始页面
-            top_clone = page.clone(pdf_dest=writer)
-            
-            # 3. 设置裁剪区域
-            top_clone.cropbox.upper_left = (0, A4_HEIGHT)        # 原页面上半部分
-            top_clone.cropbox.lower_right = (A4_WIDTH, A5_HEIGHT)
-            
-            # 4. 变换方向修正（关键！）
-            transform = Transformation().translate(
-                tx=0, 
-                ty=-(A4_HEIGHT - A5_HEIGHT)  # 正确计算平移量
-            )
-            
-            # 5. 应用变换并合并
-            top_page.merge_page(top_clone)
-            top_page.add_transformation(transform)  # 先合并后变换
-
-            # ==================================================================
-            # 处理下半部分 (已验证正确)
-            # ==================================================================
-            bottom_page = writer.add_blank_page(width=A4_WIDTH, height=A5_HEIGHT)
-            bottom_clone = page.clone(pdf_dest=writer)
-            bottom_clone.cropbox.upper_left = (0, A5_HEIGHT)
-            bottom_clone.cropbox.lower_right = (A4_WIDTH, 0)
-            bottom_page.merge_page(bottom_clone)
-
-        # 保存输出文件
-        with open(output_pdf_path, "wb") as f:
-            writer.write(f)
+        writer, saved_bytes = build_a5_writer(input_pdf_path)
+
+        # 保存输出文件（先写临时文件再原子替换）
+        publish_atomic(writer.write, output_pdf_path)
+        METRICS.inc('output_bytes_total', os.path.getsize(output_pdf_path))
             
-        print(f"生成成功：{output_pdf_path}")
+        print(f"生成成功：{output_pdf_path}（内容流共享与压缩估算节省约 {saved_bytes} 字节）")
         return True
 
     except Exception as e:
         print(f"处理失败：{str(e)}")
         return False
 
+def since_date(value):
+    """argparse类型：校验 --since 日期（YYYY-MM-DD），格式错误时由argparse提示并退出"""
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的日期：{value}（格式应为YYYY-MM-DD）") from None
+    return value
+
 
 if __name__ == "__main__":
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description="Shopify发货单转换（A4转A5）。")
+    parser.add_argument("pdf", nargs='?', help="输入PDF文件（省略时交互选择）")
+    parser.add_argument("--pages", help="只处理指定页码，如 1-3,7")
+    parser.add_argument("--order", help="只处理指定订单号所在的页面（使用缓存的订单索引）")
+    parser.add_argument("--since", type=since_date, help="交互选择时只列出该日期（YYYY-MM-DD）之后的文件")
+    parser.add_argument("--limit", type=int, default=20, help="交互选择时列出的最新文件数量（默认 20，0 表示全部）")
+    args = parser.parse_args()
+
     # 选择PDF文件，返回所选文件的路径
-    selected_pdf = select_pdf_file()
+    selected_pdf = args.pdf or select_pdf_file(limit=args.limit, since=args.since)
     
     if selected_pdf is None:
         print("错误：未选择PDF文件")
         exit(1)
 
-    # 从选定的PDF文件中提取文本及其元数据，返回包含文本和元数据的对象
-    metadata = extract_text_with_metadata(selected_pdf)
-    
-    # 分析提取的元数据，确定需要删除的目标内容，返回需要删除的目标列表
-    delete_targets = analyze_metadata(metadata)
-    
-    # 根据删除目标创建新的元数据，返回更新后的元数据对象
-    new_meta = create_new_metadata(metadata, delete_targets)
-    
-    # 调整新元数据的位置信息，返回调整后的元数据对象
-    adj_meta = adjust_metadata_positions(new_meta)
-    
-    # 打印提示信息，表示已准备好生成新PDF的元数据文件
-    print("已准备好生成新PDF的元数据文件")
-    
-    # 根据调整后的元数据生成新的A4尺寸PDF文件，返回生成文件的路径
-    A4_pdf_path = generate_new_pdf(adj_meta)
-    
-    # 将生成的A4尺寸PDF文件垂直分割为A5尺寸
-    split_a4_to_a5_vertical(A4_pdf_path)
\ No newline at end of file
+    # 确定需要处理的页面
+    selected_pages = None
+    if args.order:
+        selected_pages = lookup_order_pages(selected_pdf, args.order)
+        if not selected_pages:
+            print(f"错误：未找到订单 {args.order}")
+            exit(1)
+        print(f"订单 {args.order} 位于第 {selected_pages} 页")
+    elif args.pages:
+        try:
+            # 只读取页面树获取页数，不解析页面内容
+            page_count = len(PdfReader(selected_pdf).pages)
+        except Exception as e:
+            print(f"错误：无法读取PDF文件 {selected_pdf}：{e.__class__.__name__}: {str(e)}")
+            exit(1)
+        try:
+            selected_pages = parse_page_spec(args.pages, page_count)
+        except ValueError as e:
+            print(f"错误：{e}")
+            exit(1)
+
+    # 注册嵌入字体（未设置SPLM_FONT_DIR时跳过）
+    register_embedded_fonts()
+
+    # 每次转换使用独立的工作目录，成功后自动清理，任一阶段失败时保留
+    metadata = None
+    split_ok = False
+    try:
+        with job_workspace() as work_dir:
+            # 从选定的PDF文件中提取文本及其元数据，返回包含文本和元数据的对象
+            with METRICS.timer('extract'):
+                metadata = extract_text_with_metadata(selected_pdf, work_dir, pages=selected_pages)
+            if metadata is None:
+                raise JobFailed('提取')
+            
+            # 分析提取的元数据，确定需要删除的目标内容，返回需要删除的目标列表
+            with METRICS.timer('analyze'):
+                delete_targets = analyze_metadata(metadata)
+            if delete_targets is None:
+                raise JobFailed('分析')
+            
+            # 根据删除目标创建新的元数据，返回更新后的元数据对象
+            with METRICS.timer('layout'):
+                new_meta = create_new_metadata(metadata, delete_targets, work_dir)
+                if new_meta is None:
+                    raise JobFailed('生成元数据')
+                
+                # 调整新元数据的位置信息，返回调整后的元数据对象
+                adj_meta = adjust_metadata_positions(new_meta, work_dir)
+                
+                # 测量文本宽度，缩小或换行处理超出页面/相邻栏的长文本
+                adj_meta = fit_metadata_to_page(adj_meta)
+            
+            # 打印提示信息，表示已准备好生成新PDF的元数据文件
+            print("已准备好生成新PDF的元数据文件")
+            
+            # 根据调整后的元数据生成新的A4尺寸PDF文件，返回生成文件的路径
+            with METRICS.timer('render'):
+                A4_pdf_path = generate_new_pdf(adj_meta, work_dir)
+            if A4_pdf_path is None:
+                raise JobFailed('渲染')
+            
+            # 将生成的A4尺寸PDF文件垂直分割为A5尺寸
+            with METRICS.timer('split'):
+                split_ok = split_a4_to_a5_vertical(A4_pdf_path)
+            if not split_ok:
+                raise JobFailed('A5拆分')
+    except JobFailed as e:
+        print(f"错误：{e}阶段失败")
+
+    METRICS.inc('documents_total', status='ok' if split_ok else 'failed')
+    if metadata:
+        METRICS.inc('pages_total', len({meta['页码'] for meta in metadata}))
+
+    # 设置SPLM_METRICS_PATH时导出指标
+    METRICS.export()
+    if not split_ok:
+        exit(1)